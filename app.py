@@ -1,6 +1,9 @@
+import argparse
 import tkinter as tk
-from PIL import ImageTk
+import tracemalloc
+from PIL import Image, ImageTk
 from lib.character_generator import *
+from lib.reservoir import CharacterReservoir
 
 # Colors
 clr_bg = "#fffaf0"
@@ -9,6 +12,9 @@ clr_btn_light = "#dbbb96"
 clr_btn_dark = "#a07962"
 clr_txt = "#43364a"
 
+# Number of characters generated in advance
+PREFETCH_SIZE = 3
+
 
 def clear_widgets(frame):
     '''
@@ -18,9 +24,17 @@ def clear_widgets(frame):
         widget.destroy()
 
 
-def main():
+def prepare_character(character):
+    '''
+    This function decodes the avatar image of a character in the background, rather than on display.
+    '''
+    character.avatar
+
+
+def main(soak=0):
     '''
     Main function that initializes the app and displays its menu.
+    If soak is set, the app rolls that many characters by itself and reports its memory use (see soak_test).
     '''
 
     # Initialize app
@@ -29,6 +43,14 @@ def main():
     root.title("D&D Character Generator")
     root.eval("tk::PlaceWindow . center")
 
+    # Start generating characters in the background
+    # (refilled as soon as a character is taken)
+    reservoir = CharacterReservoir("roll", PREFETCH_SIZE, PREFETCH_SIZE, prepare=prepare_character).start()
+
+    # Load icons once (the character view is built on the first roll, then reused)
+    icons = load_icons()
+    view = {}
+
     # Create and load main frame 
     landing_frame = tk.Frame(root, width=800, height=400, bg=clr_bg)
     landing_frame.grid(row=0, column=0, columnspan=3, sticky='nesw')
@@ -67,42 +89,37 @@ def main():
         activeforeground=clr_btn_dark,
         height=1, 
         width=18,
-        command=lambda:load_character(root, landing_frame)
+        command=lambda:load_character(root, landing_frame, reservoir, icons, view)
         ).pack(pady=20)
 
+    if soak:
+        root.after(0, lambda:soak_test(root, landing_frame, reservoir, icons, view, soak))
+
     root.mainloop()
 
     return root, landing_frame
 
 
-def load_character(root, landing_frame):
+def load_icons():
     '''
-    This function creates a random character and loads a selection of attributes and information to the character frame
-    User is allowed to either roll a new character, or save the currently displayed character to a text file.
+    This function loads the hit points, armor class and speed icons (once, when the app starts).
+    '''
+    return {name: ImageTk.PhotoImage(Image.open('assets/{}_icon.png'.format(name))) for name in ['hp', 'ac', 'speed']}
+
+
+def build_character_view(root, landing_frame, reservoir, icons, view):
+    '''
+    This function creates the character frame and its widgets. 
+    It is only called once: each new character is then displayed by updating these widgets (see load_character).
     '''
 
     # Character frames
     char_frame = tk.Frame(root, bg=clr_bg)
     char_frame.grid(row=0, column=0, columnspan=5, rowspan=7, sticky='nesw')
+    view['frame'] = char_frame
 
-    # Clear all widgets
-    clear_widgets(landing_frame)
-    clear_widgets(char_frame)
-    char_frame.tkraise()
-
-    
-    # Roll character
-    my_character = generate_character("roll")
-
-    # Load icons
-    hp_icon = Image.open('assets/hp_icon.png')
-    ac_icon = Image.open('assets/ac_icon.png')
-    speed_icon = Image.open('assets/speed_icon.png')
-
-    hp_img = ImageTk.PhotoImage(hp_icon)
-    ac_img = ImageTk.PhotoImage(ac_icon)
-    speed_img = ImageTk.PhotoImage(speed_icon)
-
+    # Avatar images already converted for Tk, by avatar (there is a limited number of them)
+    view['avatar_images'] = {}
 
     # Character frame widgets
     ## Title
@@ -116,128 +133,53 @@ def load_character(root, landing_frame):
         ).grid(row=0, column=0, columnspan=5, pady=15)
 
     ## Character description
-    tk.Label(
+    view['description'] = tk.Label(
         char_frame,
-        text=my_character.__str__(),
         bg=clr_bg,
         fg=clr_txt,
         font=("TkHeadingFont",16),
         justify="center",
-        ).grid(row=1, column=0, columnspan=5, pady=15)
+        )
+    view['description'].grid(row=1, column=0, columnspan=5, pady=15)
 
     ## Character image
-    avatar=my_character.avatar
-    avatar_img=ImageTk.PhotoImage(avatar)
-    avatar_label = tk.Label(char_frame, image=avatar_img, bg=clr_bg)
-    avatar_label.image = avatar_img
-    avatar_label.grid(row=2, rowspan=5, column=0, padx=(5,0))
+    view['avatar'] = tk.Label(char_frame, bg=clr_bg)
+    view['avatar'].grid(row=2, rowspan=5, column=0, padx=(5,0))
 
     ## Character health, AC and speed
-    hp_label = tk.Label(
-                    char_frame,
-                    image=hp_img,
-                    text=my_character.attribute_dict['Hit die'],
-                    bg=clr_box,
-                    fg=clr_txt,
-                    font=("TkMenuFont",15),
-                    compound = 'top',
-                    )
-    
-    hp_label.image = hp_img
-    hp_label.grid(row=2, column=1, pady=(15,0), sticky='nesw')
-
-    ac_label = tk.Label(
-                    char_frame,
-                    image=ac_img,
-                    text=my_character.attribute_dict['Armor Class'],
-                    bg=clr_box,
-                    fg=clr_txt,
-                    font=("TkMenuFont",15),
-                    compound = 'top',
-                    )
-
-    ac_label.image = ac_img
-    ac_label.grid(row=2, column=2, pady=(15,0), sticky='nesw')
-
-    speed_label = tk.Label(
-                    char_frame,
-                    image=speed_img,
-                    text=my_character.attribute_dict['Speed'],
-                    bg=clr_box,
-                    fg=clr_txt,
-                    font=("TkMenuFont",15),
-                    compound = 'top',
-                    )
-
-    speed_label.image = speed_img
-    speed_label.grid(row=2, column=3, pady=(15,0), sticky='nesw')
-
+    for column, (icon, attribute) in enumerate([('hp', 'Hit die'), ('ac', 'Armor Class'), ('speed', 'Speed')], start=1):
+        view[attribute] = tk.Label(
+                        char_frame,
+                        image=icons[icon],
+                        bg=clr_box,
+                        fg=clr_txt,
+                        font=("TkMenuFont",15),
+                        compound = 'top',
+                        )
+        view[attribute].grid(row=2, column=column, pady=(15,0), sticky='nesw')
 
     ## Character ability scores
-    tk.Label(
+    view['Ability scores'] = tk.Label(
         char_frame,
-        text=my_character.attribute_dict['Ability scores'],
         bg=clr_box,
         fg=clr_txt,
         font=("TkMenuFont",18),
         justify='center',
-        ).grid(row=3, rowspan=3, column=1, columnspan=3, pady=(0,15), sticky='nesw')
-
-    ## Character skills
-    for k,v in my_character.attribute_dict.items():
-        if k == "Skills":
-            tk.Label(
-                char_frame,
-                text=k + ': ' + v,
-                bg=clr_box,
-                fg=clr_txt,
-                font=("TkMenuFont",11),
-                anchor='w',
-                justify='left',
-                wraplength=300
-                ).grid(row=2, column=4, padx=(0,40), pady=(15,0), sticky='nsew')
-
-    ## Character prodiciencies
-    for k,v in my_character.attribute_dict.items():
-        if k == "Proficiencies":
-            tk.Label(
-                char_frame,
-                text=k + ': ' + v,
-                bg=clr_box,
-                fg=clr_txt,
-                font=("TkMenuFont",11),
-                anchor='w',
-                justify='left',
-                wraplength=300
-                ).grid(row=3, column=4, padx=(0,40), sticky='nsew')
-
-    ## Character traits
-    for k,v in my_character.attribute_dict.items():
-        if k == "Traits":
-            tk.Label(
-                char_frame,
-                text=k + ': ' + v,
-                bg=clr_box,
-                fg=clr_txt,
-                font=("TkMenuFont",11),
-                anchor='w',
-                justify='left',
-                wraplength=300
-                ).grid(row=4, column=4, padx=(0,40), sticky='nsew')
-
-    ## Character deity
-    for k,v in my_character.attribute_dict.items():
-        if k == "Deity":
-            tk.Label(
-                char_frame,
-                text=k + ': ' + v,
-                bg=clr_box,
-                fg=clr_txt,
-                font=("TkMenuFont",11),
-                anchor='w',
-                justify='left',
-                wraplength=300
-                ).grid(row=5, column=4, padx=(0,40), pady=(0,15), sticky='nsew')
+        )
+    view['Ability scores'].grid(row=3, rowspan=3, column=1, columnspan=3, pady=(0,15), sticky='nesw')
+
+    ## Character skills, proficiencies, traits and deity
+    for attribute, row, pady in [('Skills', 2, (15,0)), ('Proficiencies', 3, 0), ('Traits', 4, 0), ('Deity', 5, (0,15))]:
+        view[attribute] = tk.Label(
+            char_frame,
+            bg=clr_box,
+            fg=clr_txt,
+            font=("TkMenuFont",11),
+            anchor='w',
+            justify='left',
+            wraplength=300
+            )
+        view[attribute].grid(row=row, column=4, padx=(0,40), pady=pady, sticky='nsew')
 
     ## Roll again button
     tk.Button(
@@ -251,10 +193,10 @@ def load_character(root, landing_frame):
         activeforeground=clr_btn_dark,
         height=1, 
         width=18,
-        command=lambda:load_character(root, landing_frame)
+        command=lambda:load_character(root, landing_frame, reservoir, icons, view)
         ).grid(row=6, column=1, columnspan=3, pady=15)
 
-    ## Save character button
+    ## Save character button (saves the character currently displayed)
     tk.Button(
         char_frame,
         text="Save character",
@@ -266,11 +208,86 @@ def load_character(root, landing_frame):
         activeforeground=clr_btn_dark,
         height=1, 
         width=18,
-        command=lambda:write_character(my_character)
+        command=lambda:write_character(view['character'])
         ).grid(row=6, column=4, pady=15)
 
 
+def load_character(root, landing_frame, reservoir, icons, view):
+    '''
+    This function picks the next random character and loads a selection of attributes and information to the character frame
+    User is allowed to either roll a new character, or save the currently displayed character to a text file.
+    '''
+
+    # Build the character frame on the first roll
+    if not view:
+        clear_widgets(landing_frame)
+        build_character_view(root, landing_frame, reservoir, icons, view)
+        view['frame'].tkraise()
+
+    # Roll character (characters are generated in advance by the reservoir)
+    my_character = reservoir.pop()
+    view['character'] = my_character
+
+    ## Character description
+    view['description'].config(text=my_character.__str__())
+
+    ## Character image
+    avatar_images = view['avatar_images']
+    if my_character.avatar_key not in avatar_images:
+        avatar_images[my_character.avatar_key] = ImageTk.PhotoImage(my_character.avatar)
+    view['avatar'].config(image=avatar_images[my_character.avatar_key])
+
+    ## Character health, AC, speed and ability scores
+    for attribute in ['Hit die', 'Armor Class', 'Speed', 'Ability scores']:
+        view[attribute].config(text=my_character.attribute_dict[attribute])
+
+    ## Character skills, proficiencies, traits and deity
+    for attribute in ['Skills', 'Proficiencies', 'Traits', 'Deity']:
+        view[attribute].config(text=attribute + ': ' + my_character.attribute_dict[attribute])
+
+
+def count_tk_objects(root):
+    '''
+    This function counts the widgets and images currently alive in the Tk interpreter.
+    '''
+    widgets = 0
+    pending = [root]
+    while pending:
+        widget = pending.pop()
+        widgets += 1
+        pending.extend(widget.winfo_children())
+
+    return widgets, len(root.tk.call('image', 'names'))
+
+
+def soak_test(root, landing_frame, reservoir, icons, view, rolls, report_every=500):
+    '''
+    This function rolls characters through the app, as if "Roll again" was clicked repeatedly,
+    and prints memory use and Tk object counts along the way: they should stay flat.
+    '''
+    tracemalloc.start()
+
+    for roll in range(1, rolls + 1):
+        load_character(root, landing_frame, reservoir, icons, view)
+        root.update()
+
+        if roll % report_every == 0 or roll == rolls:
+            widgets, images = count_tk_objects(root)
+            print('Roll {}: {:.0f} kB allocated, {} widgets, {} images'.format(
+                roll, tracemalloc.get_traced_memory()[0] / 1e3, widgets, images
+                ))
+
+    metrics = reservoir.metrics()
+    print('Reservoir: {} hits, {} misses, refill lag {:.1f} ms (max)'.format(
+        metrics['hits'], metrics['misses'], metrics['refill_lag_max'] * 1e3
+        ))
+
+    tracemalloc.stop()
+    root.destroy()
+
+
 # Run the app
 if __name__ == '__main__':
-    root, landing_frame = main()
-    
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='D&D Character Generator')
+    parser.add_argument('--soak', type=int, default=0, help='roll this many characters automatically and report memory use')
+    root, landing_frame = main(parser.parse_args().soak)
@@ -1,264 +1,386 @@
 # Utilities
+import hashlib
+import json
 import logging
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 # Pull data from API
 import requests # !pip install requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # In case of warnings regarding the urllib3 and chardet versions, try !pip3 install --upgrade requests
 
+API_URL = 'https://www.dnd5eapi.co'
+
+# Number of concurrent requests when collecting race, class and subrace data
+MAX_WORKERS = 8
+
+# Connection and read timeouts (in seconds), and retries of failed requests (with exponential backoff)
+TIMEOUT = (5, 30)
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+
+# Directory of the on-disk response cache (see enable_cache)
+CACHE_DIR = './data/http_cache'
+
+
+## HTTP SESSION ##
+
+def make_session(pool_size=MAX_WORKERS, retries=RETRIES, backoff_factor=BACKOFF_FACTOR):
+
+    """
+    Creates a requests session, reusing up to pool_size connections to the API
+    and retrying failed requests (connection errors, 429 and 5xx responses) with exponential backoff.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=('GET',),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+
+    """
+    Returns the session shared by all functions of this module (created on first use).
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+
+    return _session
+
+
+## RESPONSE CACHE ##
+
+class NotCached(requests.ConnectionError):
+
+    """
+    Raised in offline mode when a document was never cached (as the server cannot be contacted).
+    """
+
+
+class ResponseCache:
+
+    """
+    Persistent cache of API responses, one JSON file per URL storing the document and its ETag / Last-Modified headers.
+
+    Cached documents are revalidated with conditional requests: the server only sends the document again if it changed.
+    When the server cannot be reached or fails (after retries), cached documents are served instead.
+    In offline mode, cached documents are served without any request, and other documents raise NotCached.
+
+    Statistics are kept in the stats counter:
+     - hits: documents served from the cache after the server confirmed they were unchanged (304),
+     - misses: documents downloaded (not cached yet, or changed),
+     - offline: documents served from the cache in offline mode, or because the server could not be reached or failed.
+    """
+
+    def __init__(self, directory=CACHE_DIR, offline=False):
+        self.directory = directory
+        self.offline = offline
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, url:str):
+        return os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest() + '.json')
+
+    def get(self, url:str):
+        try:
+            with open(self.path(url), 'r') as json_file:
+                return json.load(json_file)
+
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, url:str, body, etag=None, last_modified=None):
+        # Write to a temporary file first, so that an interrupted write never leaves a corrupt entry
+        path = self.path(url)
+        with open(path + '.tmp', 'w') as json_file:
+            json.dump({'url': url, 'etag': etag, 'last_modified': last_modified, 'body': body}, json_file)
+        os.replace(path + '.tmp', path)
+
+    def count(self, event:str):
+        with self._lock:
+            self.stats[event] += 1
+
+
+_cache = None
+
+
+def enable_cache(directory=CACHE_DIR, offline=False):
+
+    """
+    Caches every API response on disk (see ResponseCache), and returns the cache.
+    """
+    global _cache
+    _cache = ResponseCache(directory, offline)
+    return _cache
+
+
+def disable_cache():
+
+    global _cache
+    _cache = None
+
+
+def fetch_json(url:str, session=None, timeout=TIMEOUT):
+
+    """
+    Fetches a JSON document, raising an exception if the request ultimately fails.
+
+    When the response cache is enabled, cached documents are revalidated rather than downloaded again,
+    and served as is if the server cannot be reached or fails. In offline mode, no request is ever sent.
+    """
+    session = session or get_session()
+    cache = _cache
+    entry = cache.get(url) if cache else None
+
+    if cache and cache.offline:
+        if entry is None:
+            raise NotCached('Not cached, cannot be fetched offline: {}'.format(url))
+
+        cache.count('offline')
+        return entry['body']
+
+    if entry is None:
+        response = session.get(url, timeout=timeout)
+
+    else:
+        # Conditional request: the server answers 304 Not Modified if the cached document is still valid
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            response = session.get(url, headers=headers, timeout=timeout)
+
+        # Connection errors, timeouts, retries exhausted...
+        except requests.RequestException:
+            cache.count('offline')
+            return entry['body']
+
+        if response.status_code >= 500:
+            cache.count('offline')
+            return entry['body']
+
+        if response.status_code == 304:
+            cache.count('hits')
+            return entry['body']
+
+    response.raise_for_status()
+    body = response.json()
+
+    if cache:
+        cache.put(url, body, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        cache.count('misses')
+
+    return body
+
+
+def fetch_all(urls:list, session=None, max_workers=MAX_WORKERS):
+
+    """
+    Fetches several JSON documents concurrently, with at most max_workers requests in flight.
+
+    Returns: a list of documents, in the same order as the urls.
+    """
+    session = session or get_session()
+
+    if max_workers <= 1:
+        return [fetch_json(url, session) for url in urls]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda url: fetch_json(url, session), urls))
+
+
+def fetch_listing(category:str, api_url=API_URL, listings=None):
+
+    """
+    Fetches the listing of a category from the D&D5E API.
+
+    Listings already fetched can be shared by several calls (eg. get_url and get_elements on the same category)
+    by passing them the same listings dictionary, filled with the documents by url.
+    """
+    url = api_url+'/api/'+category
+
+    if listings is None:
+        return fetch_json(url)
+
+    if url not in listings:
+        listings[url] = fetch_json(url)
+
+    return listings[url]
+
+
+## PARSERS ##
+
+def parse_race(response:dict):
+
+    """
+    Extracts languages, proficiencies, traits, speed, ability bonuses and subraces from an API race document.
+    """
+    return {
+        'languages' : [lang['name'] for lang in response['languages']],
+        'racial_traits': [trait['name'] for trait in response['traits']],
+        'starting_proficiencies' : [prof['name'] for prof in response['starting_proficiencies']],
+        'speed' : response['speed'],
+        'ability_bonus' : {score['ability_score']['name'] : score['bonus'] for score in response['ability_bonuses']},
+        'subraces' : [subrace['name'] for subrace in response['subraces']]
+    }
+
+
+def parse_class(response:dict):
+
+    """
+    Extracts hit die, saving throws, proficiencies, skill choices, equipment and subclasses from an API class document.
+    """
+    return {
+        'hit_die': response['hit_die'],
+        'saving_throws' : [saving_throw['name'] for saving_throw in response['saving_throws']],
+        'proficiencies' : [proficiency['name'] for proficiency in response['proficiencies']],
+        'chose_skills': {
+            # Additional proficiency choices : skills
+            'chose': response['proficiency_choices'][0]['choose'],
+            'skills': [
+                proficiency['item']['name'].replace('Skill: ', '')
+                for proficiency in response['proficiency_choices'][0]['from']['options']
+                ]
+        },
+        'starting_equipment' : {equipment['equipment']['name'] : equipment['quantity'] for equipment in response['starting_equipment']},
+        'subclasses' : [subclass['name'] for subclass in response['subclasses']],
+    }
+
+
+def parse_subrace(response:dict):
+
+    """
+    Extracts traits, proficiencies, ability bonuses and parent race from an API subrace document.
+    """
+    return {
+        'racial_traits': [trait['name'] for trait in response['racial_traits']],
+        'starting_proficiencies' : [prof['name'] for prof in response['starting_proficiencies']],
+        'ability_bonus' : {score['ability_score']['name'] : score['bonus'] for score in response['ability_bonuses']},
+        'race' : response['race']['name'],
+    }
+
+
+def get_details(in_dict:dict, parser, api_url=API_URL, session=None, max_workers=MAX_WORKERS):
+
+    """
+    Fetches the documents of a name - url dictionary concurrently and parses each of them.
+
+    Returns: a dictionary of parsed documents by name, in the order of in_dict.
+    """
+    responses = fetch_all([api_url+item_url for item_url in in_dict.values()], session, max_workers)
+
+    return {name: parser(response) for name, response in zip(in_dict, responses)}
+
+
 ## MAIN FUNCTIONS ##
 
-def get_url(category:str):
-    
-    """  
+def get_url(category:str, api_url=API_URL, listings=None):
+
+    """
     Collects urls from the D&D5E API.
 
-    Args: a category of interest (str). 
+    Args: a category of interest (str).
     Accepted values are 'classes', 'races', 'subclasses', 'subraces', 'alignments' and 'ability-scores'
-     
-    Returns:   
-    A list of dictionaries is generated, including : 
+    Optionally, a dictionary of listings shared between calls (see fetch_listing).
+
+    Returns:
+    A list of dictionaries is generated, including :
      - the items from this category,
-     - their url   
-     
+     - their url
+
     """
-    api_url = 'https://www.dnd5eapi.co'
-    
     out_dict = {}
-    
+
     try:
-        response = requests.get(api_url+'/api/'+category).json()
+        response = fetch_listing(category, api_url, listings)
 
         for item in response['results']:
             item_name = item['name']
             item_url = item['url']
-            
+
             out_dict.update({
                 item_name : item_url
             })
-            
-    except KeyError:
-        logging.exception('KeyError: invalid category provided ({})'.format(category))
-            
+
+    except (KeyError, requests.HTTPError):
+        logging.exception('Invalid category provided ({})'.format(category))
+
     return out_dict
 
 
-def get_elements(category:str):
-    
-    """  
-    Collects lists of items from the D&D5E API.
+def get_elements(category:str, api_url=API_URL, listings=None):
 
-    Args: a category of interest. Accepted values are 'classes', 'races', 'alignments' and 'ability-scores'
-     
-    Returns:  
-    A single list is generated, including the item names from this category,    
     """
-    api_url = 'https://www.dnd5eapi.co'
-    
-    out_list = []
-    
-    try:
-        response = requests.get(api_url+'/api/'+category).json()
+    Collects lists of items from the D&D5E API.
 
-        for item in response['results']:
-            item_name = item['name']
+    Args: a category of interest. Accepted values are 'classes', 'races', 'alignments' and 'ability-scores',
+    and optionally a dictionary of listings shared between calls (see fetch_listing).
+
+    Returns:
+    A single list is generated, including the item names from this category,
+    """
+    return list(get_url(category, api_url, listings))
 
-            
-            out_list.append(item_name)
-            
-    except KeyError:
-        logging.exception('KeyError: invalid category provided ({})'.format(category))
-                    
-    return out_list
 
+def get_race_data(in_dict:dict, api_url=API_URL, session=None, max_workers=MAX_WORKERS):
 
-def get_race_data(in_dict:dict):
-    
     """
     Collects race data from the D&D5E API.
 
-    Args: a category of interest (str). Default value is 'races'
-     
+    Args: a dictionary of race - url pairs as generated with get_url('races'),
+    and optionally the number of concurrent requests (max_workers).
+
     Returns: a nested dictionary summarizing, for each race, languages, proficiencies, traits...
     """
-    api_url = 'https://www.dnd5eapi.co'
-    
-    out_dict = {}
-        
-    
-    for race, race_url in in_dict.items():
-        
-        response = requests.get(api_url+race_url).json()
-        
-        # Get languages
-        languages = []
-    
-        for lang in response['languages']:
-            languages.append(lang['name'])
-        
-        # Get starting proficiencies
-        starting_proficiencies = []
-    
-        for prof in response['starting_proficiencies']:
-            starting_proficiencies.append(prof['name'])
-            
-        # Get racial traits
-        racial_traits = []
-        
-        for trait in response['traits']:
-            racial_traits.append(trait['name'])
-            
-        # Get speed
-        speed = response['speed']
-        
-        # Get ability score bonuses
-        ability_scores = {}
-    
-        for score in response['ability_bonuses']:
-            ability_scores.update({score['ability_score']['name'] : score['bonus']})
-
-        # Get subraces
-        subraces = []
-
-        for subrace in response['subraces']:
-            subraces.append(subrace['name'])
-
-        out_dict.update({
-            race : {
-                'languages' : languages,
-                'racial_traits': racial_traits,
-                'starting_proficiencies' : starting_proficiencies,
-                'speed' : speed,
-                'ability_bonus' : ability_scores,
-                'subraces' : subraces
-            }
-        })
-            
-    return out_dict
+    return get_details(in_dict, parse_race, api_url, session, max_workers)
 
 
-def get_class_data(in_dict:dict):
-    
+def get_class_data(in_dict:dict, api_url=API_URL, session=None, max_workers=MAX_WORKERS):
+
     """
     Collects class data from the D&D5E API.
 
-    Args: a category of interest (str). Default value is 'classes'     
-     
+    Args: a dictionary of class - url pairs as generated with get_url('classes'),
+    and optionally the number of concurrent requests (max_workers).
+
      Returns: a nested dictionary summarizing, for each class, hit die, proficiencies...
     """
+    return get_details(in_dict, parse_class, api_url, session, max_workers)
 
-    api_url = 'https://www.dnd5eapi.co'
-    
-    out_dict = {}
-    
-    for classname, class_url in in_dict.items():
-        
-        response = requests.get(api_url+class_url).json()
-            
-        # Get hit die
-        hit_die = response['hit_die']
-        
-        # Get saving throws
-        saving_throws = []
-        
-        for saving_throw in response['saving_throws']:
-            saving_throws.append(saving_throw['name'])
-    
-          
-        # Get class proficiencies
-        proficiencies = []
-        
-        for proficiency in response['proficiencies']:
-            proficiencies.append(proficiency['name'])
-
-        
-        # Additional proficiency choices : skills
-        skill_choice = []
-
-        nb_skills = response['proficiency_choices'][0]['choose']
-    
-        for proficiency in response['proficiency_choices'][0]['from']['options']:
-            skill_choice.append(proficiency['item']['name'].replace('Skill: ', ''))        
-                
-        # Get starting equipment
-        starting_equipment = {}
-    
-        for equipment in response['starting_equipment']:
-            starting_equipment.update({equipment['equipment']['name'] : equipment['quantity']})
-
-        # Get subclasses
-        subclasses = []
-
-        for subclass in response['subclasses']:
-            subclasses.append(subclass['name'])
-                
-        # Output dictionary
-        out_dict.update({
-            classname : {
-                'hit_die': hit_die,
-                'saving_throws' : saving_throws,
-                'proficiencies' : proficiencies,
-                'chose_skills': {
-                    'chose': nb_skills,
-                    'skills': skill_choice
-                },
-                'starting_equipment' : starting_equipment,
-                'subclasses' : subclasses,
-            }
-        })             
-        
-    return out_dict
 
+def get_subrace_data(in_dict:dict, api_url=API_URL, session=None, max_workers=MAX_WORKERS):
 
-def get_subrace_data(in_dict:dict):
-    
     """
     Collects subrace data from the D&D5E API.
 
-    Args: a category of interest (str). 
-     
+    Args: a dictionary of subrace - url pairs as generated with get_url('subraces'),
+    and optionally the number of concurrent requests (max_workers).
+
     Returns: a nested dictionary summarizing, for each subrace, languages, proficiencies, traits...
     """
-    api_url = 'https://www.dnd5eapi.co'
-    
-    out_dict = {}
-        
-    
-    for subrace, subrace_url in in_dict.items():
-        
-        response = requests.get(api_url+subrace_url).json()
-
-        # Get starting proficiencies
-        starting_proficiencies = []
-    
-        for prof in response['starting_proficiencies']:
-            starting_proficiencies.append(prof['name'])
-            
-        # Get racial traits
-        racial_traits = []
-        
-        for trait in response['racial_traits']:
-            racial_traits.append(trait['name'])
-            
-        
-        # Get ability score bonuses
-        ability_scores = {}
-    
-        for score in response['ability_bonuses']:
-            ability_scores.update({score['ability_score']['name'] : score['bonus']})
-        
-        
-        # Get race
-        race = response['race']['name']
-
-
-        out_dict.update({
-            subrace : {
-                'racial_traits': racial_traits,
-                'starting_proficiencies' : starting_proficiencies,
-                'ability_bonus' : ability_scores,
-                'race' : race,
-            }
-        })
-            
-    return out_dict
\ No newline at end of file
+    return get_details(in_dict, parse_subrace, api_url, session, max_workers)
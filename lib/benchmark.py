@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+from lib import character_generator
+from lib.character_batch import generate_batch
+from lib.character_generator import PlayerCharacter, format_character, generate_character, generate_characters, load_dataset
+
+BASELINE_PATH = './data/benchmark_baseline.json'
+
+# A stage is flagged when it is this much slower than the baseline (0.5 = 50% slower)...
+TOLERANCE = 0.5
+
+# ... and by more than this many microseconds (sub-microsecond stages are mostly timing noise)
+NOISE_FLOOR = 0.5
+
+# Modules whose import time is tracked, and heavy modules they must not import (Pillow and tkinter are only needed by the app)
+STARTUP_MODULES = ['lib.character_generator', 'lib.exporter', 'lib.character_batch']
+HEAVY_MODULES = ['PIL', 'tkinter']
+
+# Rows of the CharacterBatch whose memory use is measured
+BATCH_ROWS = 100000
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_call(func, number, repeat=5):
+    """
+    Returns the best time per call of a function over several repeats, in microseconds.
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def load_dataset_cold(compiled=True):
+    """
+    Loads the dataset from disk, bypassing the process-wide cache,
+    from the compiled dataset file (or from the JSON file, building every table, if compiled is False).
+    """
+    character_generator._dataset_cache.clear()
+    return load_dataset(compiled=compiled)
+
+
+def stage_benchmarks(dataset):
+    """
+    Returns a dictionary of the pipeline stages to time, each stage being a function without arguments.
+
+    Per-character stages are run on the same fully generated character.
+    """
+    character = generate_character('roll')
+
+    return {
+        'load_dataset (cold)': load_dataset_cold,
+        'load_dataset (cold, json)': lambda: load_dataset_cold(compiled=False),
+        'load_dataset (cached)': load_dataset,
+        'PlayerCharacter.__init__': lambda: PlayerCharacter(dataset),
+        'roll_subrace': lambda: character.roll_subrace(dataset),
+        'roll_subclass': lambda: character.roll_subclass(dataset),
+        'roll_ability_scores (standard)': lambda: character.roll_ability_scores(dataset, 'standard'),
+        'roll_ability_scores (roll)': lambda: character.roll_ability_scores(dataset, 'roll'),
+        'set_avatar': character.set_avatar,
+        'set_hit_points': character.set_hit_points,
+        'set_armor_class': character.set_armor_class,
+        'roll_skills': lambda: character.roll_skills(dataset),
+        'roll_proficiencies': lambda: character.roll_proficiencies(dataset),
+        'roll_deity': lambda: character.roll_deity(dataset),
+        'clean_attributes': character.clean_attributes,
+        'render_attributes': character.render_attributes,
+        'format_character': lambda: format_character(character),
+        'generate_character (standard)': lambda: generate_character('standard'),
+        'generate_character (roll)': lambda: generate_character('roll'),
+    }
+
+
+def party_benchmarks():
+    """
+    Returns the party generators to time (see lib.party), tables being built beforehand.
+    """
+    from lib.party import PartyGenerator
+
+    return {
+        'generate_party (4, balanced)': PartyGenerator(4),
+        'generate_party (5, 1+ Priest)': PartyGenerator(5, roles={'Priest': 1}),
+    }
+
+
+def measure_memory(n):
+    """
+    Returns the memory held per generated character and the peak memory while generating n characters, in bytes.
+    """
+    tracemalloc.start()
+    characters = [generate_character('roll') for _ in range(n)]
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del characters
+
+    return {'bytes per character': held / n, 'peak bytes ({} characters)'.format(n): peak}
+
+
+def measure_batch_memory(n):
+    """
+    Returns the memory held per row by a CharacterBatch of n characters (see lib.character_batch), in bytes.
+    """
+    tracemalloc.start()
+    batch = generate_batch(n, 'roll', seed=0)
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del batch
+
+    return {'bytes per batch row ({:,} rows)'.format(n): held / n}
+
+
+def import_time(module, repeat=5):
+    """
+    Returns the best import time of a module in a fresh interpreter (python -X importtime), in microseconds,
+    and the heavy modules it imported.
+    """
+    best, heavy = None, []
+    code = 'import sys, {}; print(",".join(name for name in {!r} if name in sys.modules))'.format(module, HEAVY_MODULES)
+
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code], cwd=REPO_DIR, capture_output=True, text=True, check=True
+            )
+
+        # Lines read "import time: self [us] | cumulative | imported package"
+        for line in process.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                cumulative = int(fields[1])
+                best = cumulative if best is None else min(best, cumulative)
+
+        heavy = [name for name in process.stdout.strip().split(',') if name]
+
+    return best, heavy
+
+
+def run_benchmarks(number=2000, repeat=5, batch_rows=BATCH_ROWS):
+    """
+    Times every stage of the generation pipeline, end to end throughput and memory use.
+
+    Returns: a dictionary with stage timings (microseconds per call), throughput (characters per second), parties per second, memory (bytes),
+    import times (microseconds) and the heavy modules imported by each module.
+    """
+    dataset = load_dataset()
+
+    stages = {}
+    for name, func in stage_benchmarks(dataset).items():
+        # Loading from disk is orders of magnitude slower than the other stages
+        stages[name] = time_call(func, max(number // 100, 1) if 'cold' in name else number, repeat)
+
+    throughput = {}
+    for method in ['standard', 'roll']:
+        throughput['generate_character ({})'.format(method)] = 1e6 / stages['generate_character ({})'.format(method)]
+
+        start = time.perf_counter()
+        generate_characters(number, method, seed=0)
+        throughput['generate_characters ({})'.format(method)] = number / (time.perf_counter() - start)
+
+    parties = {}
+    for name, generator in party_benchmarks().items():
+        start = time.perf_counter()
+        generator.generate_many(max(number // 4, 1), seed=0)
+        parties[name] = max(number // 4, 1) / (time.perf_counter() - start)
+
+    startup, heavy_imports = {}, {}
+    for module in STARTUP_MODULES:
+        startup['import ' + module], heavy_imports[module] = import_time(module, repeat)
+
+    return {
+        'stages': stages,
+        'throughput': throughput,
+        'parties': parties,
+        'memory': {**measure_memory(min(number, 1000)), **measure_batch_memory(batch_rows)},
+        'startup': startup,
+        'heavy_imports': heavy_imports,
+    }
+
+
+def compare(results, baseline, tolerance=TOLERANCE, noise_floor=NOISE_FLOOR):
+    """
+    Returns the list of (stage, baseline time, new time) for stages slower than the baseline by more than the tolerance
+    (and by more than the noise floor, in microseconds).
+    """
+    regressions = []
+
+    for section in ['stages', 'startup']:
+        for name, timing in results[section].items():
+            reference = baseline.get(section, {}).get(name)
+            if reference is not None and timing > reference * (1 + tolerance) and timing - reference > noise_floor:
+                regressions.append((name, reference, timing))
+
+    return regressions
+
+
+def print_report(results, baseline=None):
+    """
+    Prints benchmark results (and the baseline, if any) to the terminal.
+    """
+    print('{:<36}{:>14}{:>14}'.format('Stage', 'us / call', 'baseline'))
+    print(64*'*')
+    for name, timing in results['stages'].items():
+        reference = baseline['stages'].get(name) if baseline else None
+        print('{:<36}{:>14.2f}{:>14}'.format(name, timing, '' if reference is None else '{:.2f}'.format(reference)))
+
+    print(64*'*')
+    for name, rate in results['throughput'].items():
+        print('{:<36}{:>14,.0f} characters / s'.format(name, rate))
+
+    print(64*'*')
+    for name, rate in results['parties'].items():
+        print('{:<36}{:>14,.0f} parties / s'.format(name, rate))
+
+    print(64*'*')
+    for name, size in results['memory'].items():
+        print('{:<36}{:>14,.0f} bytes'.format(name, size))
+
+    print(64*'*')
+    for name, timing in results['startup'].items():
+        reference = baseline.get('startup', {}).get(name) if baseline else None
+        print('{:<36}{:>14.0f}{:>14}'.format(name, timing, '' if reference is None else '{:.0f}'.format(reference)))
+
+
+def main(argv=None):
+    """
+    Command line entry point: python -m lib.benchmark [--save-baseline]
+
+    Exits with status 1 when a stage (or an import) is slower than the stored baseline by more than the tolerance,
+    or when a module imports Pillow or tkinter.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the character generation pipeline.')
+    parser.add_argument('--number', type=int, default=2000, help='calls per timing repeat')
+    parser.add_argument('--repeat', type=int, default=5, help='timing repeats (the best one is kept)')
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS, help='rows of the batch whose memory use is measured')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed slowdown before flagging a stage')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline file')
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.number, args.repeat, args.batch_rows)
+
+    heavy_imports = {module: names for module, names in results.pop('heavy_imports').items() if names}
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as out_file:
+            json.dump(results, out_file, indent=2)
+        print_report(results)
+        return 0
+
+    try:
+        with open(args.baseline, 'r') as json_file:
+            baseline = json.load(json_file)
+
+    except FileNotFoundError:
+        baseline = None
+
+    print_report(results, baseline)
+
+    regressions = compare(results, baseline, args.tolerance) if baseline else []
+    for name, reference, timing in regressions:
+        print('Regression: {} took {:.2f} us (baseline {:.2f} us)'.format(name, timing, reference))
+
+    for module, names in heavy_imports.items():
+        print('Regression: importing {} loads {}'.format(module, ', '.join(names)))
+
+    return 1 if regressions or heavy_imports else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
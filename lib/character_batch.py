@@ -0,0 +1,166 @@
+import array
+import random
+
+from lib.character_generator import PlayerCharacter, generate_characters, load_dataset
+
+# Columns of integer codes (into the dataset vocabularies) and their array type
+CODE_COLUMNS = {
+    'gender': 'B',
+    'alignment': 'B',
+    'race': 'B',
+    'subrace': 'B',
+    'class': 'B',
+    'subclass': 'B',
+    'deity': 'H',
+}
+
+# Stored in the ID column for characters without an ID (this ID is reserved)
+NO_ID = 2**64 - 1
+
+# Character attribute stored in each column
+ATTRIBUTES = {
+    'gender': 'gender',
+    'alignment': 'alignment',
+    'race': 'race',
+    'subrace': 'subrace',
+    'class': 'classname',
+    'subclass': 'subclass',
+    'deity': 'deity',
+}
+
+
+class CharacterBatch:
+    """
+    Compact, column-oriented storage for large numbers of characters.
+
+    Categorical attributes (race, subrace, class, subclass, alignment, deity and gender) are stored as small integer
+    codes into the dataset vocabularies, ability scores in a single int8 array (6 consecutive values per character),
+    character IDs in a uint64 array and skills as a uint64 per character, packing the skill codes in the order
+    they were rolled. Everything else (hit points, proficiencies, inventory...) derives from these and is only rebuilt
+    when a row is accessed: batch[i] returns a regular PlayerCharacter, identical to the character stored.
+
+    Each row takes 30 bytes (about 31 bytes with the spare capacity of the arrays, for 1,000,000 rows, as measured by
+    python -m lib.benchmark), instead of about 1,450 bytes per PlayerCharacter.
+    """
+    def __init__(self, dataset=None):
+        self.dataset = dataset or load_dataset()
+        self.columns = {field: array.array(typecode) for field, typecode in CODE_COLUMNS.items()}
+        self.ability_scores = array.array('b')
+        self.ids = array.array('Q')
+        self.skills = array.array('Q')
+
+        # Skills are packed as (code + 1) in skill_bits bits each, 0 ending the list
+        self.skill_bits = len(self.dataset.vocabularies['skill']).bit_length()
+
+    def __len__(self):
+        return len(self.skills)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the columns, in bytes.
+        """
+        arrays = list(self.columns.values()) + [self.ability_scores, self.ids, self.skills]
+        return sum(len(column) * column.itemsize for column in arrays)
+
+    # Method to add a character to the batch
+    def append(self, character):
+
+        codes = self.dataset.codes
+
+        for field, column in self.columns.items():
+            column.append(codes[field][getattr(character, ATTRIBUTES[field])])
+
+        self.ability_scores.extend(character.ability_scores[ability] for ability in self.dataset['ability_scores'])
+        self.ids.append(NO_ID if character.character_id is None else character.character_id)
+        self.skills.append(self.pack_skills(character.skills))
+
+    def pack_skills(self, skills):
+
+        if len(skills) * self.skill_bits > 64:
+            raise ValueError('Too many skills to be stored: {}'.format(skills))
+
+        codes = self.dataset.codes['skill']
+        return sum((codes[skill] + 1) << (position * self.skill_bits) for position, skill in enumerate(skills))
+
+    def unpack_skills(self, packed):
+
+        vocabulary = self.dataset.vocabularies['skill']
+        mask = (1 << self.skill_bits) - 1
+        skills = []
+
+        while packed:
+            skills.append(vocabulary[(packed & mask) - 1])
+            packed >>= self.skill_bits
+
+        return skills
+
+    # Method to add several characters to the batch
+    def extend(self, characters):
+
+        for character in characters:
+            self.append(character)
+
+    # Rebuild the character stored at a given row
+    def __getitem__(self, index):
+
+        index = range(len(self))[index] # Handles negative indices and raises IndexError when out of range
+        dataset = self.dataset
+        vocabularies = dataset.vocabularies
+        values = {field: vocabularies[field][column[index]] for field, column in self.columns.items()}
+
+        # Core character
+        character = PlayerCharacter(
+            dataset,
+            gender=values['gender'],
+            alignment=values['alignment'],
+            race=values['race'],
+            classname=values['class']
+            )
+        character.subrace = values['subrace']
+        character.subclass = values['subclass']
+        character.deity = values['deity']
+        character_id = self.ids[index]
+        character.character_id = None if character_id == NO_ID else character_id
+
+        # Ability scores, modifiers and derived features
+        width = len(dataset['ability_scores'])
+        scores = self.ability_scores[index * width:(index + 1) * width]
+        character.ability_scores = dict(zip(dataset['ability_scores'], scores))
+        character.ability_modifiers = {score:((value-10) // 2) for score,value in character.ability_scores.items()}
+        character.set_avatar()
+        character.set_hit_points()
+        character.set_armor_class()
+
+        # Skills and proficiencies
+        character.skills = self.unpack_skills(self.skills[index])
+        character.roll_proficiencies(dataset) # Proficiencies only depend on class, race and subrace
+
+        character.clean_attributes()
+
+        return character
+
+
+def generate_batch(n, method, seed=None, chunk_size=10000):
+    """
+    Generates n random characters straight into a CharacterBatch.
+
+    Characters are generated with generate_characters, chunk_size at a time,
+    so that only one chunk of PlayerCharacter objects is held in memory at any time.
+    As with generate_characters, characters have no ID: the batch can only be generated again as a whole, from its seed.
+
+    Args: the number of characters, the method used to roll ability scores ("standard" or "roll") and an optional seed.
+
+    Returns: a CharacterBatch of n characters.
+    """
+    rng = random.Random(seed)
+    batch = CharacterBatch()
+
+    for start in range(0, n, chunk_size):
+        batch.extend(generate_characters(min(chunk_size, n - start), method, rng.getrandbits(64)))
+
+    return batch
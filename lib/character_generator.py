@@ -1,39 +1,514 @@
+import collections
+import csv
+import functools
+import hashlib
+import itertools
 import json
+import marshal
+import os
 import random
+import sys
+import threading
 from collections import Counter
-from PIL import Image
+from collections.abc import Mapping
+from types import MappingProxyType
+
+from lib.profiling import StageProfiler
+
+DATASET_PATH = './data/dataset.json'
+
+# Compiled dataset, stored next to dataset.json (see compile_dataset)
+COMPILED_SUFFIX = '.bin'
+COMPILED_FORMAT = b'DNDSET1'
+
+# Version of the compiled tables: bump it whenever CompiledDataset.build_tables changes, so that compiled files are rebuilt
+TABLES_VERSION = 1
+
+# Compiled files are only read by the tables version and Python version (marshal format) that wrote them
+COMPILED_HEADER = b'%s %d %d.%d\n' % (COMPILED_FORMAT, TABLES_VERSION, *sys.version_info[:2])
+
+GENDERS = ('Female', 'Male')
+
+# Pantheon worshipped by each race or subrace (eg. Drow)
+RACE_PANTHEON = {
+    'Dragonborn' : 'Human deities',
+    'Dwarf' : 'Morndinsamman',
+    'Gnome' : 'Lords of the Golden Hills',
+    'Halfling' : "Yondalla's Children",
+    'Half-Elf' : 'Seldarine', 
+    'Half-Orc' : 'Orcish pantheon',
+    'Human' : 'Human deities', 
+    'Elf' : 'Seldarine', 
+    'Drow' : 'Dark Seldarine',
+    'Tiefling' : 'Human deities'
+}
+
+# Mixed races, who may also worship human deities
+MIXED_RACES = ('Half-Elf', 'Half-Orc')
+
+# Ability score tables
+## Standard array, and all of its possible assignments to the six abilities
+STANDARD_ARRAY = (15, 14, 13, 12, 10, 8)
+STANDARD_PERMUTATIONS = tuple(itertools.permutations(STANDARD_ARRAY))
+
+## Exact distribution of 4d6 drop lowest: number of the 1296 possible outcomes giving each score
+## (written out rather than enumerated when the module is imported, see lib.probability)
+ROLL_SCORES = tuple(range(3, 19))
+ROLL_WEIGHTS = (1, 4, 10, 21, 38, 62, 91, 122, 148, 167, 172, 160, 131, 94, 54, 21)
+ROLL_CUM_WEIGHTS = tuple(itertools.accumulate(ROLL_WEIGHTS))
 
 # Load dataset 
 
-def load_dataset():
-    with open('./data/dataset.json','r') as json_file:
-        dataset = json.load(json_file)
+def freeze(obj):
+    """
+    Recursively converts dictionaries to read-only mappings and lists to tuples.
+    """
+    if isinstance(obj, dict):
+        return MappingProxyType({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(freeze(v) for v in obj)
+    if isinstance(obj, tuple) and any(isinstance(v, (dict, list, tuple)) for v in obj):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+
+def intern_values(obj, memo=None):
+    """
+    Recursively interns the strings of a JSON-like object, and shares equal tuples
+    (lists being converted to tuples and read-only mappings to dictionaries), so that each distinct value is stored once.
+    """
+    memo = {} if memo is None else memo
+
+    if isinstance(obj, str):
+        return sys.intern(obj)
+    if isinstance(obj, (dict, MappingProxyType)):
+        return {intern_values(k, memo): intern_values(v, memo) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        obj = tuple(intern_values(v, memo) for v in obj)
+        try:
+            return memo.setdefault(obj, obj)
+        except TypeError: # Tuples of dictionaries cannot be shared
+            return obj
+    return obj
+
+
+def ordered_unique(iterable):
+    """
+    Returns the unique items of an iterable as a tuple, in order of first appearance.
+    """
+    return tuple(dict.fromkeys(iterable))
+
+
+def ability_bonus(dataset, race, subrace):
+    """
+    Returns the racial (and subracial) ability bonuses as a tuple aligned with dataset['ability_scores'].
+    """
+    bonus = Counter(dataset['races'][race]['ability_bonus'])
+
+    if subrace != race:
+        bonus.update(dataset['subraces'][subrace]['ability_bonus'])
+
+    return tuple(bonus[ability] for ability in dataset['ability_scores'])
+
+
+def merge_proficiencies(dataset, classname, race, subrace):
+    """
+    Returns the proficiencies of a class, race and subrace combination as a tuple of unique values.
+    """
+    # Fetch class-related proficiencies without accounting for saving throws (which were added to proficiencies for some reason)
+    proficiencies = [proficiency for proficiency in dataset['classes'][classname]['proficiencies'] if 'Saving Throw' not in proficiency]
+
+    # Two races have skills as starting proficiencies (these are handled as skills instead)
+    skill_race = any(prof.startswith('Skill: ') for prof in dataset['races'][race]['starting_proficiencies'])
+
+    if not skill_race and race != subrace:
+        # Append race and subrace starting proficiencies
+        proficiencies += dataset['races'][race]['starting_proficiencies']
+        proficiencies += dataset['subraces'][subrace]['starting_proficiencies']
+
+    return ordered_unique(proficiencies)
+
+
+def deity_choices(dataset, race, subrace, classname, subclass):
+    """
+    Returns the deities a character of a given race, subrace, class and subclass may worship, as a tuple.
+    """
+    # Match the character race or subrace (eg. Drow) to a pantheon, the subrace taking precedence
+    pantheons = [pantheon for name, pantheon in RACE_PANTHEON.items() if name == race or name == subrace]
+
+    if not pantheons:
+        return ()
+
+    pantheon = dataset['deities'][pantheons[-1]]
+
+    # Handles the specific case of clerics, for which domain (subclass) must match their deity's.
+    if classname == 'Cleric':
+        match_domain = tuple(deity for deity, deity_att in pantheon.items() if subclass in deity_att['deity_domains'])
+
+        # In case no deity from the pantheon matches the domain, select any deity from the pantheon
+        return match_domain or tuple(pantheon)
+
+    # Add human deities as options for mixed races
+    elif race in MIXED_RACES:
+        return tuple(pantheon) + tuple(dataset['deities']['Human deities'])
+
+    return tuple(pantheon)
+
+
+def pluralize_equipment(equipment):
+    """
+    Returns an inventory as a readable comma-separated list, item names being plural when the character carries more than 1.
+    """
+    return ', '.join(str(number) + ' ' + (item + 's' if number > 1 else item) for item, number in equipment.items())
+
+
+def text_fragments(dataset):
+    """
+    Returns the parts of character sheets that only depend on race, subrace or class, already converted to strings:
+     * traits, languages: by race,
+     * saving_throws, inventory: by class,
+     * proficiencies: by (class, race, subrace) (see merge_proficiencies),
+     * ability_lines: the line of each ability score, by (ability, final score).
+    """
+    races = dataset['races']
+    classes = dataset['classes']
+
+    return {
+        'traits': {race: ', '.join(attributes['racial_traits']) for race, attributes in races.items()},
+        'languages': {race: ', '.join(attributes['languages']) for race, attributes in races.items()},
+        'saving_throws': {classname: ', '.join(attributes['saving_throws']) for classname, attributes in classes.items()},
+        'inventory': {classname: pluralize_equipment(attributes['starting_equipment']) for classname, attributes in classes.items()},
+        'proficiencies': {key: ', '.join(proficiencies) for key, proficiencies in dataset.merged_proficiencies.items()},
+        'ability_lines': {
+            (ability, score): '{}\t{} ({})'.format(ability, score, (score - 10) // 2)
+            for ability in dataset['ability_scores'] for score in range(1, 31)
+            },
+    }
+
+
+class CompiledDataset(Mapping):
+    """
+    Immutable view of dataset.json, shared by every character generated in the process.
+
+    It behaves like the dictionary returned by json.load (dataset['races'], dataset['classes']...)
+    but cannot be modified, so a single instance can safely be reused across calls and threads.
+
+    Vocabularies list every possible value of the categorical attributes of a character, 
+    so that these can be stored as small integer codes (see lib.character_batch).
+
+    Choice tables are also built once, so that each roll_* method of PlayerCharacter is a single lookup:
+     * race_names, class_names: tuples of playable races and classes,
+     * subrace_choices, subclass_choices: subraces (resp. subclasses) of each race (resp. class), or the race (class) itself,
+     * skill_choices: skills available to each class, and the number of skills to pick,
+     * race_skills: skills granted by a race as starting proficiencies, without the "Skill: " prefix,
+     * merged_proficiencies: class, race and subrace proficiencies by (class, race, subrace),
+     * ability_bonuses: ability bonuses by (race, subrace), aligned with dataset['ability_scores'],
+     * deity_choices: deities a character may worship, by (race, subrace, class, subclass).
+
+    Tables previously built from the same data (see compile_dataset) can be provided instead of being built again.
+    Text fragments of character sheets (see text_fragments) are built on first use.
+    """
+    TABLES = (
+        'race_names', 'class_names', 'subrace_choices', 'subclass_choices', 'skill_choices', 'race_skills',
+        'merged_proficiencies', 'ability_bonuses', 'deity_choices', 'vocabularies', 'codes',
+    )
+
+    def __init__(self, raw, path=DATASET_PATH, signature=None, digest=None, tables=None):
+        self._data = freeze(raw)
+        self.path = path
+        self.signature = signature # (mtime, size) of the file the dataset was loaded from
+        self.digest = digest # blake2b hash of the file contents
+        self._fragments = None
+
+        if tables is None:
+            self.build_tables()
+        else:
+            for name in self.TABLES:
+                setattr(self, name, tables[name])
+
+    def build_tables(self):
+        races = self._data['races']
+        classes = self._data['classes']
+
+        # Choice tables
+        self.race_names = tuple(races)
+        self.class_names = tuple(classes)
+        self.subrace_choices = {race: attributes['subraces'] or (race,) for race, attributes in races.items()}
+        self.subclass_choices = {classname: attributes['subclasses'] or (classname,) for classname, attributes in classes.items()}
+        self.skill_choices = {
+            classname: (attributes['chose_skills']['skills'], attributes['chose_skills']['chose']) for classname, attributes in classes.items()
+            }
+        self.race_skills = {
+            race: tuple(prof.replace('Skill: ', '') for prof in attributes['starting_proficiencies'] if prof.startswith('Skill: '))
+            for race, attributes in races.items()
+            }
+
+        self.merged_proficiencies = {}
+        self.ability_bonuses = {}
+        self.deity_choices = {}
+
+        for race in races:
+            for subrace in self.subrace_choices[race]:
+                self.ability_bonuses[(race, subrace)] = ability_bonus(self._data, race, subrace)
+
+                for classname in classes:
+                    self.merged_proficiencies[(classname, race, subrace)] = merge_proficiencies(self._data, classname, race, subrace)
+
+                    for subclass in self.subclass_choices[classname]:
+                        deities = deity_choices(self._data, race, subrace, classname, subclass)
+                        if deities:
+                            self.deity_choices[(race, subrace, classname, subclass)] = deities
+
+        # Vocabularies of categorical attributes (a subrace or subclass may be the race or class itself)
+
+        self.vocabularies = {
+            'gender': GENDERS,
+            'alignment': self._data['alignments'],
+            'race': tuple(races),
+            'subrace': ordered_unique(itertools.chain(races, self._data['subraces'])),
+            'class': tuple(classes),
+            'subclass': ordered_unique(itertools.chain(classes, *(attributes['subclasses'] for attributes in classes.values()))),
+            'deity': ordered_unique(itertools.chain(*self._data['deities'].values())),
+            'skill': ordered_unique(itertools.chain(
+                *(attributes['chose_skills']['skills'] for attributes in classes.values()),
+                *self.race_skills.values()
+                )),
+        }
+
+        ## Reverse lookup: code of each value
+        self.codes = {field: {value: code for code, value in enumerate(values)} for field, values in self.vocabularies.items()}
+
+    def tables(self):
+        """
+        Returns the choice tables and vocabularies, by attribute name.
+        """
+        return {name: getattr(self, name) for name in self.TABLES}
+
+    @property
+    def fragments(self):
+        if self._fragments is None:
+            self._fragments = text_fragments(self)
+        return self._fragments
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __reduce__(self):
+        # Read-only mappings cannot be pickled: the dataset is loaded again from its file (eg. in worker processes)
+        return load_dataset, (self.path,)
+
+    # Datasets are immutable: copies of a character share its dataset
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+_dataset_cache = {}
+_dataset_lock = threading.Lock()
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def compile_dataset(path=DATASET_PATH, compiled_path=None):
+    """
+    Compiles dataset.json to a binary file (dataset.bin by default): the data, choice tables and vocabularies,
+    serialized with marshal, strings being interned.
+
+    The compiled file records the hash of the JSON file it was built from, and is ignored by load_dataset once the JSON file changes.
+
+    Returns: the compiled dataset.
+    """
+    with open(path, 'rb') as json_file:
+        content = json_file.read()
+
+    digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+    dataset = CompiledDataset(json.loads(content), path=path, signature=_file_signature(path), digest=digest)
+    write_compiled(dataset, compiled_path or os.path.splitext(path)[0] + COMPILED_SUFFIX)
+
+    return dataset
+
+
+def write_compiled(dataset, compiled_path):
+    """
+    Writes a compiled dataset to a binary file (written to a temporary file first, so that readers never see a partial file,
+    even when several processes compile the dataset at once).
+    """
+    state = intern_values({'digest': dataset.digest, 'data': dataset._data, 'tables': dataset.tables()})
+
+    temp_path = '{}.{}.tmp'.format(compiled_path, os.getpid())
+
+    with open(temp_path, 'wb') as out_file:
+        out_file.write(COMPILED_HEADER)
+        out_file.write(marshal.dumps(state))
+    os.replace(temp_path, compiled_path)
+
+
+def read_compiled(compiled_path, digest):
+    """
+    Reads the state of a compiled dataset, if its file exists and was built from a JSON file with the given hash,
+    by the same tables version and Python version (see COMPILED_HEADER).
+
+    Returns: the state (data, tables) or None.
+    """
+    try:
+        with open(compiled_path, 'rb') as bin_file:
+            content = bin_file.read()
+
+        if not content.startswith(COMPILED_HEADER):
+            return None
+
+        state = marshal.loads(memoryview(content)[len(COMPILED_HEADER):])
+
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    return state if state['digest'] == digest else None
+
+
+def load_dataset(path=DATASET_PATH, compiled=True):
+    """
+    Returns the compiled dataset, parsing the JSON file only once per process.
+
+    The file is stat'ed on every call: the cached dataset is rebuilt if its modification time or size changed.
+
+    Unless compiled is False, the choice tables are read from the compiled file next to the JSON file (see compile_dataset)
+    when it is up to date, and the compiled file is (re)written otherwise.
+    """
+    signature = _file_signature(path)
+    dataset = _dataset_cache.get(path)
+
+    if dataset is not None and dataset.signature == signature:
         return dataset
 
+    with _dataset_lock:
+        dataset = _dataset_cache.get(path)
+
+        if dataset is None or dataset.signature != signature:
+            with open(path, 'rb') as json_file:
+                content = json_file.read()
+
+            digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+            compiled_path = os.path.splitext(path)[0] + COMPILED_SUFFIX
+            state = read_compiled(compiled_path, digest) if compiled else None
+
+            if state is not None:
+                dataset = CompiledDataset(state['data'], path=path, signature=signature, digest=digest, tables=state['tables'])
+
+            else:
+                dataset = CompiledDataset(json.loads(content), path=path, signature=signature, digest=digest)
+
+                if compiled:
+                    # Best effort, like Python's own bytecode cache (eg. on a read-only installation)
+                    try:
+                        write_compiled(dataset, compiled_path)
+                    except OSError:
+                        pass
+
+            _dataset_cache[path] = dataset
+
+    return dataset
+
+
+# Avatars
+
+## Define a group for each class (this trick allows us to use the same avatar for several classes)
+CLASS_GROUP = {
+    'Fighter': 'Warrior',
+    'Ranger': 'Warrior',
+    'Paladin': 'Warrior',
+    'Barbarian': 'Warrior',
+    'Cleric': 'Priest',
+    'Druid': 'Priest',
+    'Monk': 'Priest',
+    'Wizard': 'Wizard',
+    'Warlock': 'Wizard',
+    'Sorcerer': 'Wizard',
+    'Rogue': 'Rogue',
+    'Bard': 'Rogue'
+    }
+
+AVATAR_SIZE = (400, 400)
+AVATAR_CACHE_SIZE = 32
+
+
+@functools.lru_cache(maxsize=AVATAR_CACHE_SIZE)
+def load_avatar(group, race, gender_initial):
+    """
+    Loads an avatar image and resizes it for display.
+
+    Resized images are kept in a bounded cache (least recently used images are dropped first),
+    so each PNG file is decoded once rather than once per character. 
+    Cached images are shared between characters and should not be modified in place.
+
+    Pillow is only imported here, so that generating characters without displaying them does not load it.
+    """
+    from PIL import Image
+
+    return Image.open("assets/{}/{}_{}_single.png".format(group, race, gender_initial)).resize(AVATAR_SIZE)
+
+
+# Ability scores
+
+def draw_ability_scores(method, n, rng=random):
+    """
+    Draws the raw ability scores of n characters in a single call.
+
+    Args:
+     * method: "standard" assigns the standard array in a random order, "roll" sums the highest 3 of 4d6,
+     * n: number of characters,
+     * rng: random number generator (the random module or a random.Random instance).
+
+    Returns: a flat list of n x 6 scores, in the order of dataset['ability_scores'] for each character.
+    """
+    if method == 'standard':
+        return [score for permutation in rng.choices(STANDARD_PERMUTATIONS, k=n) for score in permutation]
+
+    elif method == 'roll':
+        return rng.choices(ROLL_SCORES, cum_weights=ROLL_CUM_WEIGHTS, k=n * len(STANDARD_ARRAY))
+
+    raise ValueError('Unknown ability score method: {}'.format(method))
+
+
 # Create a new class for the player character
 
 class PlayerCharacter:
 
-  #class default constructor
-    def __init__(self, dataset):
+  #class default constructor (core attributes are rolled unless provided)
+    def __init__(self, dataset, rng=random, gender=None, alignment=None, race=None, classname=None):
         
-        # Core character
-        self.gender = random.choice(['Female', 'Male'])
-        self.alignment = random.choice(dataset['alignments'])
-        self.race = random.choice(list(dataset['races'].keys()))
-        self.classname = random.choice(list(dataset['classes'].keys()))
+        # Core character (the ID is set by generate_character)
+        self.character_id = None
+        self.gender = gender or rng.choice(GENDERS)
+        self.alignment = alignment or rng.choice(dataset['alignments'])
+        self.race = race or rng.choice(dataset.race_names)
+        self.classname = classname or rng.choice(dataset.class_names)
                 
-        # Core features
+        # Core features (characters get their own copies of the shared, read-only dataset values)
         self.base_hit_die = dataset['classes'][self.classname]['hit_die']
         self.speed = dataset['races'][self.race]['speed']
-        self.saving_throws = dataset['classes'][self.classname]['saving_throws']
+        self.saving_throws = list(dataset['classes'][self.classname]['saving_throws'])
 
         # Racial attributes
-        self.traits = dataset['races'][self.race]['racial_traits']
-        self.languages = dataset['races'][self.race]['languages']
+        self.traits = list(dataset['races'][self.race]['racial_traits'])
+        self.languages = list(dataset['races'][self.race]['languages'])
         
         # Inventory
-        self.equipment = dataset['classes'][self.classname]['starting_equipment']
+        self.equipment = dict(dataset['classes'][self.classname]['starting_equipment'])
+
+        # Attributes are rendered on demand, from the sheet strings of the dataset (see text_fragments)
+        self.dataset = dataset
+        self._attribute_dict = None
  
 
         
@@ -48,86 +523,44 @@ class PlayerCharacter:
                                     )
 
 
-    # Method to roll character subrace 
-    def roll_subrace(self, dataset):
-    
-        for race in dataset['races'].keys():
-            if race == self.race:
-                try:
-                    self.subrace = random.choice(dataset['races'][race]['subraces'])
-                
-                except IndexError:
-                    self.subrace = self.race
-                    
+    # Method to roll character subrace (or keep the race when it has none)
+    def roll_subrace(self, dataset, rng=random):
+
+        self.subrace = rng.choice(dataset.subrace_choices[self.race])
                     
-    # Method to roll character subclass               
-    def roll_subclass(self, dataset):
-    
-        for classname in dataset['classes'].keys():
-            if classname == self.classname:
-            
-                try:
-                    self.subclass = random.choice(dataset['classes'][classname]['subclasses'])
-                
-                except IndexError:
-                    self.subclass = self.classname
+    # Method to roll character subclass (or keep the class when it has none)
+    def roll_subclass(self, dataset, rng=random):
+
+        self.subclass = rng.choice(dataset.subclass_choices[self.classname])
 
     # Method to roll character skills               
-    def roll_skills(self, dataset):
-    
-        for classname in dataset['classes'].keys():
-            if classname == self.classname:
-            
-                self.skills = random.sample(dataset['classes'][classname]['chose_skills']['skills'], dataset['classes'][classname]['chose_skills']['chose'])
-                
-                # Two races have skills as starting proficiencies
-                if self.race in ['Half-Orc' ,'Elf']: 
+    def roll_skills(self, dataset, rng=random):
 
-                    # Append these skills to the list generated above and keep only unique values  
-                    self.skills = list(set(self.skills + [skill.replace('Skill: ', '') for skill in dataset['races'][self.race]['starting_proficiencies']])) 
-                    
+        skills, number = dataset.skill_choices[self.classname]
+        self.skills = rng.sample(skills, number)
+
+        # Two races have skills as starting proficiencies: append these to the list generated above, keeping only unique values
+        for skill in dataset.race_skills[self.race]:
+            if skill not in self.skills:
+                self.skills.append(skill)
                     
-    # Method to determine character proficiencies               
-    def roll_proficiencies(self, dataset):
-    
-        for classname in dataset['classes'].keys():
-            if classname == self.classname:
-                
-                # Fetch class-related proficiencies without accounting for saving throws (which were added to proficiencies for some reason)
-                self.proficiencies = [proficiency for proficiency in dataset['classes'][classname]['proficiencies'] if 'Saving Throw' not in proficiency]
-                
-                # Two races have skills as starting proficiencies
-                if self.race not in ['Half-Orc' ,'Elf'] and self.race != self.subrace:  
+    # Method to determine character proficiencies (class, race and subrace proficiencies are merged when the dataset is loaded)
+    def roll_proficiencies(self, dataset, rng=random):
 
-                    # Append race and subrace starting proficiencies and keep only unique values 
-                    self.proficiencies = list(set(self.proficiencies + dataset['races'][self.race]['starting_proficiencies'] + dataset['subraces'][self.subrace]['starting_proficiencies']))
+        self.proficiencies = list(dataset.merged_proficiencies[(self.classname, self.race, self.subrace)])
 
 
     # Method to roll ability scores and determine modifiers
-    def roll_ability_scores(self, dataset, method):   
-    
-        # If the standard method is used
-        if method == 'standard':
-    
-            standard_array = [15, 14, 13, 12, 10, 8]
-            raw_roll = dict(zip(dataset['ability_scores'], random.sample(standard_array,6)))
-      
-        # If the roll method is used
-        elif method == 'roll':
-        
-            rolled_array = []
-            for ability in dataset['ability_scores']:
-                rolled_array.append(sum(sorted(random.randint(1, 6) for i in range(4))[1:]))
-        
-            raw_roll = dict(zip(dataset['ability_scores'], rolled_array))
-        
-        # Add racial ability bonuses
-        if self.subrace != self.race:
+    def roll_ability_scores(self, dataset, method, rng=random):   
 
-            self.ability_scores = dict(Counter(raw_roll) + Counter(dataset['races'][self.race]['ability_bonus']) + Counter(dataset['subraces'][self.subrace]['ability_bonus']))
-            
-        else:
-            self.ability_scores = dict(Counter(raw_roll) + Counter(dataset['races'][self.race]['ability_bonus']))
+        self.set_ability_scores(dataset, draw_ability_scores(method, 1, rng))
+
+    # Method to add racial bonuses to raw ability scores and determine modifiers
+    def set_ability_scores(self, dataset, raw_scores):
+
+        # Add racial ability bonuses
+        bonus = dataset.ability_bonuses[(self.race, self.subrace)]
+        self.ability_scores = {ability: score + extra for ability, score, extra in zip(dataset['ability_scores'], raw_scores, bonus)}
 
         # Calculate modifiers
         self.ability_modifiers = {score:((value-10) // 2) for score,value in self.ability_scores.items()}
@@ -135,26 +568,13 @@ class PlayerCharacter:
     # Method to pick an avatar
     def set_avatar(self):
 
-        # Define a group for each class (this trick allows us to use the same avatar for several classes)
-        class_group = {
-            'Fighter': 'Warrior',
-            'Ranger': 'Warrior',
-            'Paladin': 'Warrior',
-            'Barbarian': 'Warrior',
-            'Cleric': 'Priest',
-            'Druid': 'Priest',
-            'Monk': 'Priest',
-            'Wizard': 'Wizard',
-            'Warlock': 'Wizard',
-            'Sorcerer': 'Wizard',
-            'Rogue': 'Rogue',
-            'Bard': 'Rogue'
-            }
+        # Select an avatar based on group, race and gender (the image is only loaded when first displayed)
+        self.avatar_key = (CLASS_GROUP[self.classname], self.race, self.gender[:1])
 
-        # Select an avatar based on group, race and gender
-        self.avatar = Image.open(
-            "assets/{}/{}_{}_single.png".format(class_group[self.classname], self.race, self.gender[:1])
-            ).resize((400, 400))
+    # Avatar image, loaded on first access from the avatar cache
+    @property
+    def avatar(self):
+        return load_avatar(*self.avatar_key)
 
     # Method to set hit points 
     def set_hit_points(self): 
@@ -164,100 +584,110 @@ class PlayerCharacter:
     def set_armor_class(self):
         self.armor_class = 10 + self.ability_modifiers['DEX']
 
-    # Method to roll a deity
-    def roll_deity(self, dataset):   
-    
-        race_panth = {
-            'Dragonborn' : 'Human deities',
-            'Dwarf' : 'Morndinsamman',
-            'Gnome' : 'Lords of the Golden Hills',
-            'Halfling' : "Yondalla's Children",
-            'Half-Elf' : 'Seldarine', 
-            'Half-Orc' : 'Orcish pantheon',
-            'Human' : 'Human deities', 
-            'Elf' : 'Seldarine', 
-            'Drow' : 'Dark Seldarine',
-            'Tiefling' : 'Human deities'
-        }
-    
-        # Match each character race or subrace (eg. Drow) to a pantheon
-        for race, pantheon in race_panth.items():
-            if race == self.race or race == self.subrace:  
-
-                # Handles the specific case of clerics, for which domain (subclass) must match their deity's.
-                if self.classname == 'Cleric':
+    # Method to roll a deity, from the pantheon of the character race or subrace (see deity_choices)
+    def roll_deity(self, dataset, rng=random):   
 
-                    match_domain = []
+        deities = dataset.deity_choices.get((self.race, self.subrace, self.classname, self.subclass))
 
-                    for deity, deity_att in dataset['deities'][pantheon].items():
-                        if self.subclass in deity_att['deity_domains']:
-                            match_domain.append(deity)
-
-                    try:
-                        self.deity = random.choice(match_domain)
-                
-                    except IndexError: # In case no deity from the pantheon matches the domain, select any deity from the pantheon
-                        self.deity = random.choice(list(dataset['deities'][pantheon]))
+        if deities:
+            self.deity = rng.choice(deities)
 
-                # Add human deities as options for mixed races
-                elif self.race == 'Half-Elf' or self.race == 'Half-Orc':
-                    self.deity = random.choice(list(dataset['deities'][pantheon]) + list(dataset['deities']['Human deities']))
+    # Method to mark the attributes as final: the readable attribute dictionary is only rendered when first needed
+    def clean_attributes(self):
 
-                else:
-                    self.deity = random.choice(list(dataset['deities'][pantheon]))
+        self._attribute_dict = None
 
-    # Method to generate a dictionary of attributes after converting them to human readable strings
-    def clean_attributes(self):
+    # Dictionary of attributes converted to human readable strings (rendered on first access)
+    @property
+    def attribute_dict(self):
 
-        # Ability scores and modifiers
-        ## Add modifiers
-        ability_dict = {score: str(self.ability_scores[score]) + ' (' + str(self.ability_modifiers.get(score, '')) + ')' for score in self.ability_scores.keys()}
+        if self._attribute_dict is None:
+            self._attribute_dict = self.render_attributes()
 
-        ## Convert the dictionary to a readable comma-separated list of scores
-        ability_list = [ability + '\t' + score for ability, score in ability_dict.items()]
+        return self._attribute_dict
 
-        ### Convert the list to a string
-        ability_scores = ', '.join(ability_list).replace(', ', '\n')
+    # Method to render the attribute dictionary, race and class dependent strings coming from the dataset fragments
+    # as long as the character still has the values of its race and class (its own values are joined otherwise)
+    def render_attributes(self):
 
-        # Lists of skills, proficiencies, etc.
-        skills = ', '.join(self.skills)
-        proficiencies = ', '.join(self.proficiencies)
-        saving_throws = ', '.join(self.saving_throws)
-        traits = ', '.join(self.traits)
-        languages = ', '.join(self.languages)
-    
-    
-        # Items in the inventory 
-        ## Set item names to plural when the character carries more than 1
-        item_dict = {k + 's' if v > 1 else k:v for k,v in self.equipment.items()}
-    
-        ## Convert the dictionary to a readable comma-separated list of items
-        item_list = [str(number) + ' ' + item for item, number in item_dict.items()]
+        dataset = self.dataset
+        fragments = dataset.fragments
+        race = dataset['races'][self.race]
+        classname = dataset['classes'][self.classname]
 
-        ## Convert the list to a string
-        inventory = ', '.join(item_list)
+        # Ability scores and modifiers, one per line
+        ability_lines = fragments['ability_lines']
+        ability_scores = '\n'.join(
+            ability_lines.get((ability, score)) or '{}\t{} ({})'.format(ability, score, self.ability_modifiers.get(ability, ''))
+            for ability, score in self.ability_scores.items()
+            )
 
-        # Write output
+        proficiencies = dataset.merged_proficiencies.get((self.classname, self.race, self.subrace))
 
-        self.attribute_dict = {
+        return {
             "Ability scores" : ability_scores,
             "Hit die" : str(self.hit_point),
             "Armor Class": str(self.armor_class),
             "Speed" : str(self.speed),
-            "Skills" : skills,
-            "Proficiencies" : proficiencies,
-            "Saving throws": saving_throws,
-            "Traits" : traits,
-            "Languages": languages,
+            "Skills" : ', '.join(self.skills),
+            "Proficiencies" : (fragments['proficiencies'][(self.classname, self.race, self.subrace)]
+                               if proficiencies is not None and tuple(self.proficiencies) == proficiencies
+                               else ', '.join(self.proficiencies)),
+            "Saving throws": (fragments['saving_throws'][self.classname]
+                              if tuple(self.saving_throws) == classname['saving_throws'] else ', '.join(self.saving_throws)),
+            "Traits" : fragments['traits'][self.race] if tuple(self.traits) == race['racial_traits'] else ', '.join(self.traits),
+            "Languages": fragments['languages'][self.race] if tuple(self.languages) == race['languages'] else ', '.join(self.languages),
             "Deity":str(self.deity),
-            "Base inventory": inventory
+            "Base inventory": (fragments['inventory'][self.classname]
+                               if tuple(self.equipment.items()) == tuple(classname['starting_equipment'].items())
+                               else pluralize_equipment(self.equipment))
         }
 
 
 
 # Generate the character
 
-def generate_character(method):
+# Profiling (disabled by default)
+
+_profiler = None
+
+
+def enable_profiling(profiler=None):
+    """
+    Starts recording per-stage latencies of generate_character, and returns the profiler collecting them
+    (call its snapshot() or to_json() method to read the statistics).
+    """
+    global _profiler
+    _profiler = profiler or StageProfiler()
+    return _profiler
+
+
+def disable_profiling():
+    """
+    Stops recording latencies. When disabled, the only cost left in generate_character is a check per stage.
+    """
+    global _profiler
+    _profiler = None
+
+
+def make_character_id(seed, index):
+    """
+    Packs a master seed and the index of a character into a 64-bit character ID (both must fit in 32 bits).
+    """
+    if not (0 <= seed < 2**32 and 0 <= index < 2**32):
+        raise ValueError('Seed and index must be between 0 and 2**32 - 1 (got {} and {})'.format(seed, index))
+
+    return (seed << 32) | index
+
+
+def split_character_id(character_id):
+    """
+    Returns the (master seed, index) pair a character ID was made from.
+    """
+    return character_id >> 32, character_id & 0xFFFFFFFF
+
+
+def generate_character(method, character_id=None):
     """
     This function generates a random D&D 5E player character according to the Player's Handbook.
 
@@ -266,75 +696,313 @@ def generate_character(method):
      * the "standard" method, distributing randomly across scores an array of fixed values, 
      * or the "roll" method where 4d6 are rolled for each score, and the highest 3 are summed.
 
+    Optionally, a 64-bit character ID (see make_character_id): all rolls are drawn from a random
+    number generator seeded with it, so the same ID and method always give back the same character.
+    A random ID is drawn when none is provided.
+
     Returns: A random playable character to either print in the Terminal or output in a text file.
+    The ID it was generated from is stored as its character_id attribute.
+
+    Stage latencies are recorded when profiling is enabled (see enable_profiling).
     """
-    # Load dataset
+    timer = _profiler and _profiler.timer()
+
+    # Load dataset (parsed once, then served from the process-wide cache)
     dataset = load_dataset()
+    if timer:
+        timer.lap('dataset')
+
+    # Seed the random number generator of the character
+    if character_id is None:
+        character_id = random.getrandbits(64)
+
+    rng = random.Random(character_id)
 
     # Generate the main attributes of the character
-    new_character = PlayerCharacter(dataset)
+    new_character = PlayerCharacter(dataset, rng)
+    new_character.character_id = character_id
+    if timer:
+        timer.lap('core')
     
     # Roll a subrace
-    new_character.roll_subrace(dataset)
+    new_character.roll_subrace(dataset, rng)
+    if timer:
+        timer.lap('subrace')
     
     # Roll a subclass
-    new_character.roll_subclass(dataset)
+    new_character.roll_subclass(dataset, rng)
+    if timer:
+        timer.lap('subclass')
     
     # Roll ability scores
-    new_character.roll_ability_scores(dataset, method)
+    new_character.roll_ability_scores(dataset, method, rng)
+    if timer:
+        timer.lap('abilities')
 
-    # Select avatar
+    # Select avatar (the image is loaded the first time new_character.avatar is accessed)
     new_character.set_avatar()
+    if timer:
+        timer.lap('avatar')
 
     # Set hit points and AC
     new_character.set_hit_points()
     new_character.set_armor_class()
+    if timer:
+        timer.lap('hp_ac')
 
     # Roll skills and proficiencies
-    new_character.roll_skills(dataset)
-    new_character.roll_proficiencies(dataset)
+    new_character.roll_skills(dataset, rng)
+    if timer:
+        timer.lap('skills')
+
+    new_character.roll_proficiencies(dataset, rng)
+    if timer:
+        timer.lap('proficiencies')
 
     # Roll a deity
-    new_character.roll_deity(dataset)
+    new_character.roll_deity(dataset, rng)
+    if timer:
+        timer.lap('deity')
 
     # Generate a dictionary of attributes
     new_character.clean_attributes()
+    if timer:
+        timer.lap('clean_attributes')
+        timer.finish()
    
     return new_character
 
 
+def generate_characters(n, method, seed=None):
+    """
+    This function generates a batch of n random D&D 5E player characters.
+
+    Core attributes are drawn for the whole batch at once, as are the n x 6 raw ability scores.
+    Racial bonuses are then added to the flat score array and modifiers computed over it, 
+    instead of rolling each character stage by stage. As for generate_character, avatar images are only loaded when accessed.
+
+    As rolls are drawn for the whole batch, characters have no ID (character_id is None) and cannot be generated again
+    on their own: only the whole batch can, from its seed. Use generate_roster for characters that can.
+
+    Args: 
+     * n: the number of characters to generate,
+     * method: the method used to roll ability scores ("standard" or "roll", see generate_character),
+     * seed: an optional seed, so that the same arguments always produce the same characters.
+
+    Returns: A list of n random playable characters.
+    """
+    # Load dataset and set up a random number generator for the batch
+    dataset = load_dataset()
+    rng = random.Random(seed)
+    abilities = dataset['ability_scores']
+    width = len(abilities)
+
+    # Draw core attributes and raw ability scores for the whole batch
+    genders = rng.choices(GENDERS, k=n)
+    alignments = rng.choices(dataset['alignments'], k=n)
+    races = rng.choices(dataset.race_names, k=n)
+    classnames = rng.choices(dataset.class_names, k=n)
+    raw_scores = draw_ability_scores(method, n, rng)
+
+    # Generate the main attributes, subraces and subclasses
+    characters = []
+    for i in range(n):
+        new_character = PlayerCharacter(dataset, rng, genders[i], alignments[i], races[i], classnames[i])
+        new_character.roll_subrace(dataset, rng)
+        new_character.roll_subclass(dataset, rng)
+        characters.append(new_character)
+
+    # Add racial bonuses to the flat array of scores and calculate modifiers
+    bonuses = []
+    for character in characters:
+        bonuses.extend(dataset.ability_bonuses[(character.race, character.subrace)])
+
+    scores = [score + bonus for score, bonus in zip(raw_scores, bonuses)]
+    modifiers = [(score - 10) // 2 for score in scores]
+
+    # Finish each character
+    for i, character in enumerate(characters):
+        row = slice(i * width, (i + 1) * width)
+        character.ability_scores = dict(zip(abilities, scores[row]))
+        character.ability_modifiers = dict(zip(abilities, modifiers[row]))
+
+        character.set_avatar()
+        character.set_hit_points()
+        character.set_armor_class()
+        character.roll_skills(dataset, rng)
+        character.roll_proficiencies(dataset, rng)
+        character.roll_deity(dataset, rng)
+        character.clean_attributes()
+
+    return characters
+
+
 # Display and export the character
 
-def print_character(character):
+def format_character(character):
     """
-    Print character string and attributes to the terminal
+    Returns the character string and attributes as a text sheet
     """
-
-    print(character)
-    print(15*'*')
+    lines = [str(character), 15*'*']
     for k,v in character.attribute_dict.items():
         if k == "Ability scores":
-            print(k)
-            print(v)
-            print(15*'*')
+            lines += [k, v, 15*'*']
         else:
-            print(k, ':', v)
+            lines.append('{} : {}'.format(k, v))
 
+    return '\n'.join(lines) + '\n'
 
-def write_character(character):
 
+def print_character(character):
     """
-    Write character string and attributes to a text file
+    Print character string and attributes to the terminal
     """
-    with open("character.txt", "w") as out_file:
-        print(character, file=out_file)
-        print(15*'*', file=out_file)
-        for k,v in character.attribute_dict.items():
-            if k == "Ability scores":
-                print(k, file=out_file)
-                print(v, file=out_file)
-                print(15*'*', file=out_file)
-            else:
-                print(k, ':', v, file=out_file)
+
+    print(format_character(character), end='')
+
+
+def write_character(character, file_name="character.txt"):
+
+    """
+    Write character string and attributes to a text file 
+    (see lib.exporter to export many characters to a single file)
+    """
+    with open(file_name, "w") as out_file:
+        out_file.write(format_character(character))
+
+
+# Bulk generation from the command line
+
+CHUNK_SIZE = 1000
+
+
+def generate_roster(count, method, seed, start=0):
+    """
+    Generates the characters of index start to start + count - 1 of the roster defined by a master seed.
+
+    Each character is generated from its own ID (see make_character_id), so any character
+    of the roster can be generated again on its own with generate_character(method, make_character_id(seed, index)).
+    """
+    for index in range(start, start + count):
+        yield generate_character(method, make_character_id(seed, index))
+
+
+def render_chunk(chunk):
+    """
+    Generates one chunk of characters and returns them rendered in the requested format.
+
+    Args: a (first character index, number of characters, method, master seed, format) tuple, 
+    format being one of the lib.exporter renderers (eg. 'text', 'jsonl', 'csv' or 'markdown').
+    The chunk only depends on these values, whichever process generates it.
+    """
+    from lib.exporter import RENDERERS
+
+    start, count, method, seed, file_format = chunk
+
+    return RENDERERS[file_format](generate_roster(count, method, seed, start))
+
+
+def generate_chunks(count, method, seed, workers=1, chunk_size=CHUNK_SIZE, file_format='text', first=0):
+    """
+    Generates count characters of a roster (see generate_roster), starting at index first, 
+    split into chunks of chunk_size, across a pool of worker processes.
+
+    Chunks are yielded in order, and at most two chunks per worker are pending at any time. 
+    As chunks do not depend on the number of workers, the output is identical for any number of workers.
+    """
+    chunks = ((first + start, min(chunk_size, count - start), method, seed, file_format) for start in range(0, count, chunk_size))
+
+    if workers <= 1:
+        yield from map(render_chunk, chunks)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+
+        for chunk in chunks:
+            pending.append(executor.submit(render_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def main(argv=None):
+    """
+    Command line entry point, eg.:
+    python -m lib.character_generator --count 100000 --method roll --workers 8 --seed 42 --output roster.txt
+    """
+    import argparse
+
+    def unsigned(bits, base=10):
+        # Argument type for integers between 0 and 2**bits - 1
+        def integer(value):
+            number = int(value, base)
+            if not 0 <= number < 2**bits:
+                raise argparse.ArgumentTypeError('must be between 0 and 2**{} - 1 (got {})'.format(bits, value))
+            return number
+        return integer
+
+    def positive(value):
+        # Argument type for integers of at least 1
+        number = int(value)
+        if number < 1:
+            raise argparse.ArgumentTypeError('must be at least 1 (got {})'.format(value))
+        return number
+
+    parser = argparse.ArgumentParser(description='Generate random D&D 5E player characters in bulk.')
+    parser.add_argument('--count', type=positive, default=1, help='number of characters to generate')
+    parser.add_argument('--method', choices=['standard', 'roll'], default='roll', help='method used to roll ability scores')
+    parser.add_argument('--workers', type=positive, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--seed', type=unsigned(32), help='master seed, between 0 and 2**32 - 1 (a random seed is drawn and reported if omitted)')
+    parser.add_argument('--character-id', type=unsigned(64, base=0), help='generate the single character with this ID instead')
+    parser.add_argument('--chunk-size', type=positive, default=CHUNK_SIZE, help='number of characters per work unit')
+    parser.add_argument('--format', choices=['text', 'jsonl', 'csv', 'markdown'], help='output format (default: guessed from the output file name)')
+    parser.add_argument('--output', default='-', help='output file, gzip compressed if it ends with .gz (default: standard output)')
+    parser.add_argument('--unique', choices=['set', 'bloom'], help='skip characters whose build was already generated, using a set or a Bloom filter (single process)')
+    args = parser.parse_args(argv)
+
+    from lib.exporter import csv_header, guess_format, open_output
+
+    if args.character_id is not None:
+        args.seed, start = split_character_id(args.character_id)
+        args.count, args.workers = 1, 1
+
+    elif args.seed is None:
+        args.seed, start = random.randrange(2**32), 0
+        print('Seed: {}'.format(args.seed), file=sys.stderr)
+
+    else:
+        start = 0
+
+    # Characters are only generated again from their ID with the same dataset
+    print('Dataset: {}'.format(load_dataset().digest), file=sys.stderr)
+
+    file_format, compress = guess_format(args.output)
+    file_format = args.format or file_format
+
+    out_file = sys.stdout if args.output == '-' else open_output(args.output, compress)
+
+    try:
+        if file_format == 'csv':
+            csv.writer(out_file).writerow(csv_header())
+
+        if args.unique:
+            from lib.uniqueness import generate_unique_chunks
+            chunks = generate_unique_chunks(args.count, args.method, args.seed, args.unique, args.chunk_size, file_format, start)
+        else:
+            chunks = generate_chunks(args.count, args.method, args.seed, args.workers, args.chunk_size, file_format, start)
+
+        for text in chunks:
+            out_file.write(text)
+
+    finally:
+        if out_file is not sys.stdout:
+            out_file.close()
 
 
+if __name__ == '__main__':
+    main()
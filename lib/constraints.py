@@ -0,0 +1,169 @@
+import itertools
+import random
+
+from lib.character_generator import GENDERS, STANDARD_PERMUTATIONS, PlayerCharacter, load_dataset
+from lib.probability import ProbabilityEngine, accepts, in_bounds, roll_distribution
+
+
+class Constraints:
+    """
+    Generates characters satisfying a set of conditions, sampling directly from the conditional distributions
+    (instead of generating characters until one matches, which gets very slow for rare combinations).
+
+    Conditions are the same as for lib.probability.ProbabilityEngine:
+     * gender, alignment, race, subrace, classname, subclass, deity: a value, or a collection of accepted values,
+     * scores: a dictionary of bounds on final ability scores (racial bonuses included), by ability:
+       a minimum (eg. {'WIS': 14}) or a (minimum, maximum) pair, None meaning no bound.
+
+    Characters follow the same distribution as those of generate_character that satisfy the conditions:
+     * (race, subrace, class, subclass) combinations are drawn with their probability times the probability
+       that the ability scores and deity of such a character satisfy the conditions,
+     * ability scores are drawn among the rolls (or standard array assignments) within bounds,
+     * deities are drawn among the accepted deities of the character pantheon.
+
+    Tables are built once per set of conditions, so that each character costs about as much as an unconstrained one.
+
+    Example: Constraints('roll', race='Dwarf', classname='Cleric', scores={'WIS': 14}).generate()
+    """
+
+    def __init__(self, method='roll', dataset=None, gender=None, alignment=None, race=None, subrace=None,
+                 classname=None, subclass=None, deity=None, scores=None):
+        self.dataset = dataset = dataset or load_dataset()
+        self.method = method
+        self.engine = engine = ProbabilityEngine(dataset, method)
+        self.conditions = {
+            'gender': gender, 'alignment': alignment, 'race': race, 'subrace': subrace,
+            'classname': classname, 'subclass': subclass, 'deity': deity, 'scores': scores,
+        }
+
+        # Gender and alignment are independent from everything else
+        self.genders = tuple(value for value in GENDERS if accepts(gender, value))
+        self.alignments = tuple(value for value in dataset['alignments'] if accepts(alignment, value))
+
+        # Ability scores within bounds, by (race, subrace)
+        bounds = engine.bounds(scores)
+        self.score_tables = {}
+        p_scores = {}
+
+        for race_, subrace_, _ in engine.race_pairs:
+            if accepts(race, race_) and accepts(subrace, subrace_):
+                bonuses = dataset.ability_bonuses[(race_, subrace_)]
+                self.score_tables[(race_, subrace_)], p_scores[(race_, subrace_)] = self.score_table(bonuses, bounds)
+
+        # Weight of each (race, subrace, class, subclass) combination, and accepted deities
+        self.combinations, weights = [], []
+
+        for race_, subrace_, p_race in engine.race_pairs:
+            if not p_scores.get((race_, subrace_)):
+                continue
+
+            for classname_, subclass_, p_class in engine.class_pairs:
+                if not (accepts(classname, classname_) and accepts(subclass, subclass_)):
+                    continue
+
+                weight = float(p_race * p_class * p_scores[(race_, subrace_)])
+                deities = None
+
+                if deity is not None:
+                    pool = dataset.deity_choices.get((race_, subrace_, classname_, subclass_), ())
+                    deities = tuple(deity_ for deity_ in pool if accepts(deity, deity_))
+
+                    if not deities:
+                        continue
+                    weight *= len(deities) / len(pool)
+
+                self.combinations.append((race_, subrace_, classname_, subclass_, deities))
+                weights.append(weight)
+
+        if not self.combinations or not self.genders or not self.alignments:
+            raise ValueError('No character can satisfy these conditions: {}'.format(
+                {name: condition for name, condition in self.conditions.items() if condition is not None}))
+
+        self.cum_weights = tuple(itertools.accumulate(weights))
+
+    def score_table(self, bonuses, bounds):
+        """
+        Returns the raw scores that keep final scores within bounds, and their probability:
+         * for rolled scores, the possible rolls of each ability and their cumulated weights,
+         * for the standard array, the possible assignments.
+        """
+        if self.method == 'roll':
+            table, probability = [], 1
+
+            for bonus, bound in zip(bonuses, bounds):
+                rolls = [(score, p) for score, p in roll_distribution().items() if in_bounds(score + bonus, bound)]
+                table.append((tuple(score for score, _ in rolls), tuple(itertools.accumulate(float(p) for _, p in rolls))))
+                probability *= sum(p for _, p in rolls)
+
+            return table, probability
+
+        elif self.method == 'standard':
+            table = [
+                permutation for permutation in STANDARD_PERMUTATIONS
+                if all(in_bounds(score + bonus, bound) for score, bonus, bound in zip(permutation, bonuses, bounds))
+            ]
+            return table, len(table) / len(STANDARD_PERMUTATIONS)
+
+        raise ValueError('Unknown ability score method: {}'.format(self.method))
+
+    def acceptance_rate(self):
+        """
+        Returns the exact probability that an unconstrained character satisfies the conditions
+        (a rejection loop would need 1 / acceptance_rate characters per match, on average).
+        """
+        return self.engine.probability(**self.conditions)
+
+    def generate(self, character_id=None):
+        """
+        Generates a character satisfying the conditions.
+
+        As with generate_character, all rolls are drawn from a random number generator seeded with the 64-bit
+        character ID (a random one is drawn if none is provided), so the same ID and conditions give back the same character.
+
+        The ID is stored as the constrained_id attribute of the character, only meaningful with the same conditions:
+        its character_id stays None (and so does the id field of exports), as generate_character would give another character.
+        """
+        dataset = self.dataset
+
+        if character_id is None:
+            character_id = random.getrandbits(64)
+
+        rng = random.Random(character_id)
+
+        race, subrace, classname, subclass, deities = rng.choices(self.combinations, cum_weights=self.cum_weights)[0]
+
+        character = PlayerCharacter(
+            dataset, rng, gender=rng.choice(self.genders), alignment=rng.choice(self.alignments), race=race, classname=classname
+            )
+        character.constrained_id = character_id
+        character.subrace = subrace
+        character.subclass = subclass
+
+        table = self.score_tables[(race, subrace)]
+        if self.method == 'roll':
+            raw_scores = [rng.choices(scores, cum_weights=cum_weights)[0] for scores, cum_weights in table]
+        else:
+            raw_scores = rng.choice(table)
+
+        character.set_ability_scores(dataset, raw_scores)
+        character.set_avatar()
+        character.set_hit_points()
+        character.set_armor_class()
+        character.roll_skills(dataset, rng)
+        character.roll_proficiencies(dataset, rng)
+
+        if deities is None:
+            character.roll_deity(dataset, rng)
+        else:
+            character.deity = rng.choice(deities)
+
+        character.clean_attributes()
+
+        return character
+
+    def generate_many(self, n, seed=None):
+        """
+        Generates n characters satisfying the conditions, reproducibly if a seed is provided.
+        """
+        rng = random.Random(seed)
+        return [self.generate(rng.getrandbits(64)) for _ in range(n)]
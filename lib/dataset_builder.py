@@ -0,0 +1,450 @@
+import argparse
+import copy
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import requests # !pip install requests
+
+from lib import api_request, webscraper
+from lib.character_generator import DATASET_PATH, RACE_PANTHEON, CompiledDataset, compile_dataset, ordered_unique
+
+# Stage outputs are cached in this directory, so that a rebuild only recomputes what changed
+BUILD_DIR = './data/build'
+
+# Stages whose outputs are cached entry by entry (the other stages are always run, API listings being revalidated)
+CACHED_STAGES = ['details', 'deities']
+
+# API categories collected as name - url pairs, and as plain lists of names
+URL_CATEGORIES = ['races', 'classes', 'subraces']
+ELEMENT_CATEGORIES = ['alignments', 'ability-scores']
+
+PARSERS = {
+    'races': api_request.parse_race,
+    'classes': api_request.parse_class,
+    'subraces': api_request.parse_subrace,
+}
+
+# Pantheons relevant to the playable races of the PHB (add desired 'Category:' items)
+PANTHEONS = [
+    'Human deities',
+    'Lords of the Golden Hills',
+    'Morndinsamman',
+    "Yondalla's Children",
+    'Orcish pantheon',
+    'Seldarine',
+    'Dark Seldarine',
+]
+
+
+## PLAYER'S HANDBOOK ADDITIONS ##
+# Basic Rules only encompass a single subrace and subclass (resp. per race and class),
+# characters being based on the Player's Handbook, some additional data is added manually
+
+PHB_SUBCLASSES = {
+    'Barbarian' : ['Berserker', 'Totem Warrior'],
+    'Bard' : ['College of Lore', 'College of Valor'],
+    'Cleric' : ['Death', 'Knowledge', 'Life', 'Light', 'Nature', 'Tempest', 'Trickery', 'War'],
+    'Druid' : ['Land', 'Moon'],
+    'Fighter' : ['Battle Master', 'Champion', 'Eldritch knight'],
+    'Monk' : ['Four Elements', 'Open Hand', 'Shadow'],
+    'Paladin' : ['Oath of the Ancients',  'Oath of Devotion', 'Oath of Vengeance'],
+    'Ranger' : ['Beast Master', 'Hunter'],
+    'Rogue' : ['Arcane trickster', 'Assassin', 'Thief'],
+    'Sorcerer' : ['Draconic Bloodline', 'Wild Mage'],
+    'Warlock' : ['Archfey', 'Fiend', 'Great Old One'],
+    'Wizard' : ['Abjurer', 'Conjurer', 'Diviner', 'Enchanter', 'Invoker', 'Illusioner', 'Necromancer', 'Transmuter']
+}
+
+# API subclasses duplicating a PHB subclass
+DUPLICATE_SUBCLASSES = {
+    'Bard' : 'Lore', # Duplicate of 'College of Lore'
+    'Paladin' : 'Devotion', # Duplicate of 'Oath of Devotion'
+    'Sorcerer' : 'Draconic', # Duplicate of 'Draconic Bloodline'
+    'Wizard' : 'Evocation', # Duplicate of 'Invoker'
+}
+
+PHB_SUBRACES = {
+    'Dwarf': ['Hill Dwarf', 'Mountain Dwarf'],
+    'Elf': ['High Elf', 'Wood Elf', 'Drow'],
+    'Gnome': ['Rock Gnome', 'Forest Gnome'],
+    'Halfling': ['Lightfoot Halfling', 'Stout Halfling'],
+}
+
+PHB_ADDITIONAL_SUBRACES = {
+    'Wood Elf' : {
+        'racial_traits' : ['Elf Weapon Training','Fleet of Foot','Mask of the Wild'],
+        'starting_proficiencies' : ['Longswords', 'Shortswords', 'Shortbows', 'Longbows'],
+        'ability_bonus' : {'WIS':1},
+        'race' : 'Elf'
+    },
+    'Drow' : {
+        'racial_traits' : ['Superior Darkvision', 'Sunlight Sensitivity', 'Drow Magic', 'Drow Weapon Training'],
+        'starting_proficiencies' : ['Rapiers', 'Shortswords', 'Hand crossbows'],
+        'ability_bonus' : {'CHA':1},
+        'race' : 'Elf'
+    },
+    'Mountain Dwarf' : {
+        'racial_traits' : ['Dwarven Armor Training'],
+        'starting_proficiencies' : ['Light Armor', 'Medium Armor'],
+        'ability_bonus' : {'STR':2},
+        'race' : 'Dwarf'
+    },
+    'Forest Gnome' : {
+        'racial_traits' : ['Natural Illustionist', 'Speak With Small Beasts'],
+        'starting_proficiencies' : [],
+        'ability_bonus' : {'DEX': 1},
+        'race' : 'Gnome'
+    },
+    'Stout Halfling' : {
+        'racial_traits' : ['Stout Resilience'],
+        'starting_proficiencies' : [],
+        'ability_bonus' : {'CON':1},
+        'race' : 'Halfling'
+    },
+}
+
+# Deities dropped from the scraped pantheons: Kozah (equivalent to Talos), and deities from ancient pantheons (Pharaonic / Mulhorandi...)
+DROPPED_DEITIES = {
+    'Human deities': ['Kozah', 'Anubis', 'Apep', 'Nephthys', 'Poseidon'],
+}
+
+# Deities renamed in the dataset
+RENAMED_DEITIES = {
+    'Human deities': {'Mystra (Midnight)': 'Mystra'},
+}
+
+
+## STAGE CACHE ##
+
+def digest(obj):
+    """
+    Returns a short hash of a JSON serializable object (the same for equal objects, whatever the key order).
+    """
+    return hashlib.blake2b(json.dumps(obj, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+class BuildCache:
+
+    """
+    Stores the output of each stage in a JSON file, with the hash of the inputs it was computed from.
+
+    A stage output is made of entries (eg. one per race), each one being recomputed only if its own inputs changed.
+    """
+
+    def __init__(self, directory=BUILD_DIR, refresh=()):
+        self.directory = directory
+        self.refresh = set(refresh)
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, stage):
+        return os.path.join(self.directory, stage + '.json')
+
+    def load(self, stage):
+        # Details are cached per category (eg. details-races)
+        if stage.split('-')[0] in self.refresh:
+            return {}
+
+        try:
+            with open(self.path(stage), 'r') as json_file:
+                return json.load(json_file)
+
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save(self, stage, entries):
+        path = self.path(stage)
+        with open(path + '.tmp', 'w') as json_file:
+            json.dump(entries, json_file)
+        os.replace(path + '.tmp', path)
+
+    def run(self, stage, inputs, compute):
+        """
+        Computes the output of each key - value pair of inputs, reusing cached outputs whose input is unchanged.
+
+        compute is called once, with the dictionary of inputs to recompute, and returns a dictionary of outputs by key.
+
+        Returns: a dictionary of outputs by key (in the order of inputs), and the list of recomputed keys.
+        """
+        cached = self.load(stage)
+        digests = {key: digest(value) for key, value in inputs.items()}
+
+        changed = [key for key in inputs if key not in cached or cached[key]['input'] != digests[key]]
+        outputs = compute({key: inputs[key] for key in changed}) if changed else {}
+
+        entries = {
+            key: {'input': digests[key], 'output': outputs[key]} if key in outputs else cached[key]
+            for key in inputs
+        }
+
+        if changed or entries.keys() != cached.keys():
+            self.save(stage, entries)
+
+        return {key: entry['output'] for key, entry in entries.items()}, changed
+
+
+## STAGES ##
+
+def fetch_listings(api_url=api_request.API_URL):
+    """
+    Stage 1: fetches the API listings (race, class and subrace urls, alignments and ability scores).
+    """
+    listings = {}
+
+    for category in URL_CATEGORIES + ELEMENT_CATEGORIES:
+        listings[category] = api_request.get_url(category, api_url)
+
+    if not all(listings.values()):
+        raise RuntimeError('Empty API listing: {}'.format([category for category, items in listings.items() if not items]))
+
+    return listings
+
+
+def fetch_details(cache, listings, api_url=api_request.API_URL):
+    """
+    Stage 2: fetches and parses the race, class and subrace documents (only documents that changed are parsed again).
+    """
+    details, changed = {}, []
+
+    for category in URL_CATEGORIES:
+        names = list(listings[category])
+        documents = api_request.fetch_all([api_url+listings[category][name] for name in names])
+
+        details[category], category_changed = cache.run(
+            'details-'+category,
+            dict(zip(names, documents)),
+            lambda documents: {name: PARSERS[category](document) for name, document in documents.items()},
+            )
+        changed += category_changed
+
+    return details, changed
+
+
+def scrape_deities(cache, pantheons=PANTHEONS, mode='static', offline=False):
+    """
+    Stage 3: scrapes deity pages from the wiki.
+
+    Pantheon pages are browsed again (to find new deities) unless offline, deity pages are only scraped
+    if not scraped before (use refresh to scrape them again).
+    """
+    if offline:
+        urls = cache.load('deity-urls')
+        if not urls:
+            raise RuntimeError('No deities were scraped yet: the first build cannot run offline')
+
+        def scrape(pages):
+            raise RuntimeError('Deity pages not scraped yet, cannot build offline: {}'.format(list(pages)))
+
+        loader = None
+
+    else:
+        loader = webscraper.make_loader(mode)
+        urls = webscraper.get_deity_url(pantheons, mode=mode, loader=loader)
+        cache.save('deity-urls', urls)
+
+        def scrape(pages):
+            with ThreadPoolExecutor(max_workers=webscraper.MAX_WORKERS) as executor:
+                return dict(zip(pages, executor.map(lambda url: webscraper.parse_deity_page(loader.get(url, webscraper.DEITY_READY)), pages)))
+
+    try:
+        # Deity pages are cached by url
+        pages = {url: url for pantheon in pantheons for url in urls[pantheon].values()}
+        pages, changed = cache.run('deities', pages, scrape)
+
+    finally:
+        if loader:
+            loader.close()
+
+    # Skip deities that are not referred to in 5E
+    deities = {
+        pantheon: {deity: pages[url] for deity, url in urls[pantheon].items() if pages[url] is not None}
+        for pantheon in pantheons
+    }
+
+    return deities, changed
+
+
+def merge(listings, details, deities):
+    """
+    Stage 4: puts the complete dataset together, adding Player's Handbook subclasses and subraces
+    and cleaning up deities.
+    """
+    details = copy.deepcopy(details)
+    races, classes, subraces = details['races'], details['classes'], details['subraces']
+
+    # Subclasses
+    for classname, subclasses in PHB_SUBCLASSES.items():
+        if classname in classes:
+            merged = ordered_unique(classes[classname]['subclasses'] + subclasses)
+            classes[classname]['subclasses'] = [subclass for subclass in merged if subclass != DUPLICATE_SUBCLASSES.get(classname)]
+
+    # Subraces
+    for race, race_subraces in PHB_SUBRACES.items():
+        if race in races:
+            races[race]['subraces'] = list(ordered_unique(races[race]['subraces'] + race_subraces))
+
+    subraces.update(copy.deepcopy(PHB_ADDITIONAL_SUBRACES))
+
+    # Deities
+    deities = copy.deepcopy(deities)
+    for pantheon, dropped in DROPPED_DEITIES.items():
+        for deity in dropped:
+            deities.get(pantheon, {}).pop(deity, None)
+
+    for pantheon, renamed in RENAMED_DEITIES.items():
+        for old_name, new_name in renamed.items():
+            if old_name in deities.get(pantheon, {}):
+                deities[pantheon][new_name] = deities[pantheon].pop(old_name)
+
+    return {
+        'races' : races,
+        'subraces' : subraces,
+        'classes' : classes,
+        'alignments' : list(listings['alignments']),
+        'ability_scores' : list(listings['ability-scores']),
+        'deities': deities,
+    }
+
+
+def validate(dataset):
+    """
+    Stage 5: checks the dataset is complete and consistent, and that the generator can compile it.
+
+    Returns: the list of problems found (empty if the dataset is valid).
+    """
+    problems = []
+
+    for race, attributes in dataset['races'].items():
+        for subrace in attributes['subraces']:
+            if subrace not in dataset['subraces']:
+                problems.append('Unknown subrace {} of {}'.format(subrace, race))
+
+        if race not in RACE_PANTHEON:
+            problems.append('No pantheon for race {}'.format(race))
+
+    for subrace, attributes in dataset['subraces'].items():
+        if attributes['race'] not in dataset['races']:
+            problems.append('Unknown race {} of subrace {}'.format(attributes['race'], subrace))
+
+    for name, attributes in list(dataset['races'].items()) + list(dataset['subraces'].items()):
+        for ability in attributes['ability_bonus']:
+            if ability not in dataset['ability_scores']:
+                problems.append('Unknown ability {} in the bonuses of {}'.format(ability, name))
+
+    for classname, attributes in dataset['classes'].items():
+        if attributes['chose_skills']['chose'] > len(attributes['chose_skills']['skills']):
+            problems.append('Not enough skills to choose from for {}'.format(classname))
+
+    for pantheon in set(RACE_PANTHEON.values()):
+        if not dataset['deities'].get(pantheon):
+            problems.append('No deities in pantheon {}'.format(pantheon))
+
+    if not problems:
+        try:
+            CompiledDataset(dataset)
+
+        except (KeyError, TypeError, ValueError) as error:
+            problems.append('Dataset cannot be compiled: {!r}'.format(error))
+
+    return problems
+
+
+def write(dataset, path=DATASET_PATH):
+    """
+    Stage 6: writes the dataset to its JSON file, unless the file is already up to date.
+
+    Returns: whether the file was written.
+    """
+    content = json.dumps(dataset)
+
+    try:
+        with open(path, 'r') as json_file:
+            if json_file.read() == content:
+                return False
+
+    except FileNotFoundError:
+        pass
+
+    with open(path + '.tmp', 'w') as json_file:
+        json_file.write(content)
+    os.replace(path + '.tmp', path)
+
+    return True
+
+
+def build_dataset(path=DATASET_PATH, build_dir=BUILD_DIR, api_url=api_request.API_URL, scrape_mode='static',
+                  offline=False, refresh=(), verbose=True):
+    """
+    Builds the dataset file used by the generator: fetch listings, fetch details, scrape deities, merge, validate and write
+    (the dataset being compiled as well, see lib.character_generator.compile_dataset).
+
+    API responses are cached (and revalidated) in the HTTP cache of lib.api_request, and the output of each stage
+    in build_dir, so that a rebuild only downloads, scrapes and parses what changed.
+
+    Args:
+     * path: the dataset file to write,
+     * build_dir: the directory of the stage caches,
+     * api_url: the D&D5E API,
+     * scrape_mode: 'static' or 'browser' (see lib.webscraper),
+     * offline: build from cached API responses and deity pages only,
+     * refresh: stages whose cached outputs are discarded (eg. ['deities'] to scrape every deity page again).
+
+    Returns: the dataset, and whether the file was written.
+    """
+    log = print if verbose else (lambda *args: None)
+
+    cache = BuildCache(build_dir, refresh)
+    api_request.enable_cache(offline=offline)
+
+    listings = fetch_listings(api_url)
+    log('listings: {}'.format(', '.join('{} {}'.format(len(items), category) for category, items in listings.items())))
+
+    details, changed = fetch_details(cache, listings, api_url)
+    log('details: {} parsed, {} unchanged'.format(len(changed), sum(map(len, details.values())) - len(changed)))
+
+    deities, changed = scrape_deities(cache, mode=scrape_mode, offline=offline)
+    log('deities: {} pages scraped, {} deities'.format(len(changed), sum(map(len, deities.values()))))
+
+    dataset = merge(listings, details, deities)
+
+    problems = validate(dataset)
+    if problems:
+        raise ValueError('Invalid dataset:\n' + '\n'.join(problems))
+    log('validate: ok')
+
+    written = write(dataset, path)
+    log('write: {} {}'.format(path, 'updated' if written else 'unchanged'))
+
+    compile_dataset(path)
+    log('compile: ok')
+
+    return dataset, written
+
+
+def main(argv=None):
+    """
+    Command line entry point: python -m lib.dataset_builder
+    """
+    parser = argparse.ArgumentParser(description='Build the dataset of races, classes and deities.')
+    parser.add_argument('--output', default=DATASET_PATH, help='dataset file')
+    parser.add_argument('--build-dir', default=BUILD_DIR, help='directory of the stage caches')
+    parser.add_argument('--api-url', default=api_request.API_URL, help='D&D5E API')
+    parser.add_argument('--scrape-mode', choices=['static', 'browser'], default='static', help='how wiki pages are loaded')
+    parser.add_argument('--offline', action='store_true', help='only use cached API responses and deity pages')
+    parser.add_argument('--refresh', nargs='*', default=[], choices=CACHED_STAGES, help='stages to recompute from scratch')
+    args = parser.parse_args(argv)
+
+    try:
+        build_dataset(args.output, args.build_dir, args.api_url, args.scrape_mode, args.offline, args.refresh)
+
+    except (RuntimeError, ValueError, requests.RequestException) as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
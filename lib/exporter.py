@@ -0,0 +1,183 @@
+import csv
+import gzip
+import io
+import itertools
+import json
+
+from lib.character_generator import format_character, load_dataset
+
+# Number of characters rendered and written at once
+BATCH_SIZE = 1000
+
+# Flat CSV columns, ability scores being added after the core attributes
+CSV_CORE_FIELDS = ['id', 'race', 'subrace', 'class', 'subclass', 'alignment', 'gender']
+CSV_FEATURE_FIELDS = ['hit_points', 'armor_class', 'speed', 'skills', 'proficiencies', 'saving_throws', 'traits', 'languages', 'deity', 'equipment']
+
+
+def character_to_dict(character):
+    """
+    Converts a character to a dictionary of JSON serializable values.
+    """
+    return {
+        'id': character.character_id,
+        'race': character.race,
+        'subrace': character.subrace,
+        'class': character.classname,
+        'subclass': character.subclass,
+        'alignment': character.alignment,
+        'gender': character.gender,
+        'ability_scores': dict(character.ability_scores),
+        'ability_modifiers': dict(character.ability_modifiers),
+        'hit_points': character.hit_point,
+        'armor_class': character.armor_class,
+        'speed': character.speed,
+        'skills': list(character.skills),
+        'proficiencies': list(character.proficiencies),
+        'saving_throws': list(character.saving_throws),
+        'traits': list(character.traits),
+        'languages': list(character.languages),
+        'deity': getattr(character, 'deity', None),
+        'equipment': dict(character.equipment),
+    }
+
+
+def csv_header():
+    """
+    Returns the list of CSV columns.
+    """
+    return CSV_CORE_FIELDS + list(load_dataset()['ability_scores']) + CSV_FEATURE_FIELDS
+
+
+def character_to_row(character):
+    """
+    Converts a character to a flat CSV row (lists are joined with commas, as in the text sheet).
+    """
+    record = character_to_dict(character)
+    record['equipment'] = ', '.join('{} {}'.format(number, item) for item, number in record['equipment'].items())
+
+    for field in ['skills', 'proficiencies', 'saving_throws', 'traits', 'languages']:
+        record[field] = ', '.join(record[field])
+
+    return [record[field] for field in CSV_CORE_FIELDS] + list(character.ability_scores.values()) + [record[field] for field in CSV_FEATURE_FIELDS]
+
+
+# Renderers: each converts a list of characters to a single string
+
+def render_text(characters):
+    return ''.join(format_character(character) + '\n' for character in characters)
+
+
+def render_jsonl(characters):
+    return ''.join(json.dumps(character_to_dict(character)) + '\n' for character in characters)
+
+
+def render_csv(characters):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(character_to_row(character) for character in characters)
+    return buffer.getvalue()
+
+
+def character_to_markdown(character):
+    """
+    Returns the character sheet as Markdown: a heading, a table of ability scores and a list of attributes.
+    """
+    attributes = character.attribute_dict
+    lines = ['## ' + str(character), '', '| Ability | Score |', '| --- | --- |']
+    lines += ['| ' + line.replace('\t', ' | ') + ' |' for line in attributes['Ability scores'].split('\n')]
+    lines.append('')
+    lines += ['- **{}**: {}'.format(name, value) for name, value in attributes.items() if name != 'Ability scores']
+
+    return '\n'.join(lines) + '\n'
+
+
+def render_markdown(characters):
+    return ''.join(character_to_markdown(character) + '\n' for character in characters)
+
+
+RENDERERS = {
+    'text': render_text,
+    'jsonl': render_jsonl,
+    'csv': render_csv,
+    'markdown': render_markdown,
+}
+
+EXTENSIONS = {
+    '.txt': 'text',
+    '.jsonl': 'jsonl',
+    '.csv': 'csv',
+    '.md': 'markdown',
+}
+
+
+def register_renderer(name, render, extension=None):
+    """
+    Adds an export format: render converts a list of characters to a single string.
+    Files ending with the extension (eg. '.html') are then exported in this format by default.
+    """
+    RENDERERS[name] = render
+
+    if extension:
+        EXTENSIONS[extension] = name
+
+
+def guess_format(path):
+    """
+    Returns the export format (eg. 'text', 'jsonl' or 'csv', see RENDERERS) and whether to compress, based on a file name (eg. roster.jsonl.gz).
+    """
+    compress = path.endswith('.gz')
+    stem = path[:-3] if compress else path
+
+    for extension, file_format in EXTENSIONS.items():
+        if stem.endswith(extension):
+            return file_format, compress
+
+    return 'text', compress
+
+
+def open_output(path, compress=False, buffer_size=1 << 20):
+    """
+    Opens a text file for writing with a large buffer, or a gzip compressed text file if requested.
+    """
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+
+    return open(path, 'w', encoding='utf-8', newline='', buffering=buffer_size)
+
+
+def export_characters(characters, path, file_format=None, compress=None, batch_size=BATCH_SIZE):
+    """
+    Streams characters to a file, in text sheet, JSONL, CSV or Markdown format.
+
+    Characters are consumed from any iterable (eg. a generator), rendered batch_size at a time
+    and written with a single call per batch, so memory use does not depend on the number of characters.
+
+    Args:
+     * characters: an iterable of characters,
+     * path: the output file,
+     * file_format: 'text', 'jsonl', 'csv', 'markdown' or a registered format (guessed from the file name if omitted),
+     * compress: whether to gzip the output (guessed from a .gz suffix if omitted),
+     * batch_size: the number of characters rendered per write.
+
+    Returns: the number of characters written.
+    """
+    guessed_format, guessed_compress = guess_format(path)
+    file_format = file_format or guessed_format
+    compress = guessed_compress if compress is None else compress
+    render = RENDERERS[file_format]
+
+    count = 0
+    characters = iter(characters)
+
+    with open_output(path, compress) as out_file:
+        if file_format == 'csv':
+            csv.writer(out_file).writerow(csv_header())
+
+        while True:
+            batch = list(itertools.islice(characters, batch_size))
+            if not batch:
+                break
+
+            out_file.write(render(batch))
+            count += len(batch)
+
+    return count
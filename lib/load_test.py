@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import sys
+import time
+from urllib.parse import urlsplit
+
+URL = 'http://127.0.0.1:8000/character?method=roll'
+
+
+async def read_response(reader):
+    """
+    Reads one HTTP response (with a Content-Length or chunked body). Returns the status code and the body size.
+    """
+    head = await reader.readuntil(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin-1').rstrip('\r\n').split('\r\n')
+    headers = dict(line.lower().split(': ', 1) for line in header_lines if ': ' in line)
+
+    if headers.get('transfer-encoding') == 'chunked':
+        size = 0
+        while True:
+            chunk_size = int(await reader.readuntil(b'\r\n'), 16)
+            await reader.readexactly(chunk_size + 2)
+            size += chunk_size
+            if chunk_size == 0:
+                return int(status_line.split(' ')[1]), size
+
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return int(status_line.split(' ')[1]), len(body)
+
+
+async def client(url, requests, latencies, errors):
+    """
+    Sends requests one after the other over a single kept-alive connection, recording their latencies.
+    """
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    target = parts.path + ('?' + parts.query if parts.query else '')
+    request = 'GET {} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(target, parts.netloc).encode()
+
+    try:
+        for _ in range(requests):
+            start = time.perf_counter()
+            writer.write(request)
+            status, _ = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+
+            if status != 200:
+                errors.append(status)
+
+    finally:
+        writer.close()
+
+
+def percentile(values, q):
+    """
+    Returns the q-th percentile of a sorted list (nearest rank).
+    """
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+async def load_test(url=URL, connections=16, requests=10000):
+    """
+    Sends requests to a character server over concurrent kept-alive connections.
+
+    Returns: a dictionary with the number of requests, errors, requests per second and latency percentiles (in milliseconds).
+    """
+    latencies, errors = [], []
+    per_client = max(1, requests // connections)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(url, per_client, latencies, errors) for _ in range(connections)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests / s': len(latencies) / elapsed,
+        'p50 (ms)': percentile(latencies, 50) * 1e3,
+        'p99 (ms)': percentile(latencies, 99) * 1e3,
+        'max (ms)': latencies[-1] * 1e3,
+    }
+
+
+def main(argv=None):
+    """
+    Command line entry point: python -m lib.load_test [--url URL] [--connections 16] [--requests 10000]
+    (start the server first, with python -m lib.server)
+    """
+    parser = argparse.ArgumentParser(description='Load test the character server.')
+    parser.add_argument('--url', default=URL)
+    parser.add_argument('--connections', type=int, default=16, help='concurrent connections')
+    parser.add_argument('--requests', type=int, default=10000, help='total number of requests')
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(load_test(args.url, args.connections, args.requests))
+
+    for name, value in results.items():
+        print('{:<16}{:>14,.2f}'.format(name, value))
+
+    return 1 if results['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import itertools
+import math
+import random
+
+from lib.character_generator import CLASS_GROUP, load_dataset
+from lib.constraints import Constraints
+from lib.probability import accepts
+
+# Party roles, as the class groups of the avatars
+ROLES = ('Warrior', 'Priest', 'Wizard', 'Rogue')
+
+
+def balanced_roles(size):
+    """
+    Returns role bounds spreading a party as evenly as possible across roles (eg. one of each role for a party of 4).
+    """
+    low, high = size // len(ROLES), -(-size // len(ROLES))
+    return {role: (low, high) for role in ROLES}
+
+
+class PartyGenerator:
+    """
+    Generates parties of characters meeting role rules, without rerolling characters until the party looks balanced.
+
+    Args:
+     * size: the number of characters in a party,
+     * method: the ability score method ('roll' or 'standard'),
+     * roles: bounds on the number of characters of each role (see ROLES), as a minimum (eg. {'Priest': 1})
+       or a (minimum, maximum) pair, None meaning no bound. Parties are balanced across roles by default (see balanced_roles),
+     * unique_classes: whether two characters of the party may share a class,
+     * conditions: conditions every character must satisfy (race, alignment, scores...: see lib.constraints.Constraints).
+
+    Classes are drawn as generate_character draws them (uniformly), conditioned on the rules: the generator counts
+    the class assignments of each role composition once, then picks a composition with its weight, shuffles
+    the roles and draws classes within each role. Each character is then drawn from a Constraints table built for its class.
+
+    Example: PartyGenerator(5, roles={'Priest': 1}).generate()
+    """
+
+    def __init__(self, size, method='roll', dataset=None, roles=None, unique_classes=True, **conditions):
+        self.dataset = dataset = dataset or load_dataset()
+        self.size = size
+        self.unique_classes = unique_classes
+
+        # A Constraints table per class (classes that cannot satisfy the conditions are left out)
+        self.members = {}
+        for classname in dataset.class_names:
+            if accepts(conditions.get('classname'), classname):
+                try:
+                    self.members[classname] = Constraints(method, dataset, **{**conditions, 'classname': classname})
+                except ValueError:
+                    continue
+
+        self.role_classes = {
+            role: tuple(classname for classname in self.members if CLASS_GROUP[classname] == role) for role in ROLES
+            }
+
+        # Number of role (and class) assignments of each composition: counts of characters per role, in ROLES order
+        bounds = balanced_roles(size) if roles is None else roles
+        unknown = set(bounds) - set(ROLES)
+        if unknown:
+            raise KeyError('Unknown roles: {}'.format(', '.join(sorted(unknown))))
+
+        self.compositions, weights = [], []
+
+        for counts in itertools.product(range(size + 1), repeat=len(ROLES)):
+            if sum(counts) != size or not all(self.allows(bounds.get(role), count) for role, count in zip(ROLES, counts)):
+                continue
+
+            weight = math.factorial(size)
+            for role, count in zip(ROLES, counts):
+                choices = len(self.role_classes[role])
+                weight //= math.factorial(count)
+                weight *= math.perm(choices, count) if unique_classes else choices ** count
+
+            if weight:
+                self.compositions.append(counts)
+                weights.append(weight)
+
+        if not self.compositions:
+            raise ValueError('No party of {} can satisfy these rules: roles {}, unique classes {}'.format(size, bounds, unique_classes))
+
+        self.cum_weights = tuple(itertools.accumulate(weights))
+
+    @staticmethod
+    def allows(bound, count):
+        if bound is None:
+            return True
+        low, high = bound if isinstance(bound, tuple) else (bound, None)
+        return (low is None or count >= low) and (high is None or count <= high)
+
+    def classes(self, rng):
+        """
+        Draws the classes of a party, in order.
+        """
+        counts = rng.choices(self.compositions, cum_weights=self.cum_weights)[0]
+        classes = []
+
+        for role, count in zip(ROLES, counts):
+            if self.unique_classes:
+                classes.extend(rng.sample(self.role_classes[role], count))
+            else:
+                classes.extend(rng.choices(self.role_classes[role], k=count))
+
+        rng.shuffle(classes)
+        return classes
+
+    def generate(self, party_id=None):
+        """
+        Generates a party, as a list of characters. The same 64-bit party ID (a random one is drawn if none is provided)
+        always gives back the same party.
+        """
+        if party_id is None:
+            party_id = random.getrandbits(64)
+
+        rng = random.Random(party_id)
+
+        return [self.members[classname].generate(rng.getrandbits(64)) for classname in self.classes(rng)]
+
+    def generate_many(self, n, seed=None):
+        """
+        Generates n parties, reproducibly if a seed is provided.
+        """
+        rng = random.Random(seed)
+        return [self.generate(rng.getrandbits(64)) for _ in range(n)]
+
+
+_generators = {}
+
+
+def generate_party(size, constraints=None, method='roll', party_id=None):
+    """
+    Generates a party of characters (see PartyGenerator).
+
+    Args:
+     * size: the number of characters,
+     * constraints: a dictionary of PartyGenerator arguments, eg. {'roles': {'Priest': 1}, 'unique_classes': True, 'race': 'Elf'},
+     * method: the ability score method,
+     * party_id: an optional 64-bit ID, to generate the same party again.
+
+    Tables are built on the first call with a given size, method and constraints, then reused.
+    """
+    constraints = constraints or {}
+    key = (size, method, repr(sorted(constraints.items())))
+
+    if key not in _generators:
+        _generators[key] = PartyGenerator(size, method, **constraints)
+
+    return _generators[key].generate(party_id)
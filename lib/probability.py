@@ -0,0 +1,251 @@
+import functools
+import itertools
+from collections import Counter
+from fractions import Fraction
+
+from lib.character_generator import GENDERS, ROLL_SCORES, ROLL_WEIGHTS, STANDARD_PERMUTATIONS, load_dataset
+
+# Attributes picked uniformly from a fixed list, in the order they are rolled by generate_character
+CATEGORIES = ('gender', 'alignment', 'race', 'subrace', 'class', 'subclass', 'deity')
+
+
+## ABILITY SCORES ##
+
+@functools.lru_cache(maxsize=None)
+def roll_distribution():
+    """
+    Returns the exact distribution of a 4d6 drop lowest roll, enumerating the 1296 possible outcomes.
+    """
+    counts = Counter(sum(sorted(dice)[1:]) for dice in itertools.product(range(1, 7), repeat=4))
+
+    # The generator samples from the same weights, written out in lib.character_generator
+    assert tuple(counts[score] for score in ROLL_SCORES) == ROLL_WEIGHTS
+
+    return {score: Fraction(counts[score], 6**4) for score in ROLL_SCORES}
+
+
+def in_bounds(value, bounds):
+    low, high = bounds
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+@functools.lru_cache(maxsize=4096)
+def score_distribution(method, bonuses, bounds, ability=None):
+    """
+    Returns the exact distribution of the final score of one ability, jointly with bounds on every ability score.
+
+    Args:
+     * method: 'roll' or 'standard' (see lib.character_generator.draw_ability_scores),
+     * bonuses: racial bonuses, one per ability (see CompiledDataset.ability_bonuses),
+     * bounds: a (minimum, maximum) pair per ability (None for no bound), bounds applying to final scores (bonuses included),
+     * ability: the index of the ability of interest, or None.
+
+    Returns: a dictionary of probabilities by final score of the ability ({None: probability} if ability is None),
+    each being the probability of this score and of every score being within its bounds.
+    """
+    if method == 'roll':
+        # The six scores are rolled independently
+        distribution = roll_distribution()
+        total = Fraction(1)
+        outcomes = {None: total}
+
+        for index, (bonus, bound) in enumerate(zip(bonuses, bounds)):
+            finals = {score + bonus: p for score, p in distribution.items() if in_bounds(score + bonus, bound)}
+
+            if index == ability:
+                outcomes = finals
+            else:
+                total *= sum(finals.values())
+
+        return {score: p * total for score, p in outcomes.items()}
+
+    elif method == 'standard':
+        # Every assignment of the standard array is equally likely
+        counts = Counter()
+
+        for permutation in STANDARD_PERMUTATIONS:
+            finals = [score + bonus for score, bonus in zip(permutation, bonuses)]
+            if all(in_bounds(final, bound) for final, bound in zip(finals, bounds)):
+                counts[None if ability is None else finals[ability]] += 1
+
+        return {score: Fraction(count, len(STANDARD_PERMUTATIONS)) for score, count in counts.items()}
+
+    raise ValueError('Unknown ability score method: {}'.format(method))
+
+
+## CHARACTERS ##
+
+def accepts(condition, value):
+    """
+    Returns whether a value satisfies a condition: None (any value), a single value, or a collection of values.
+    """
+    if condition is None:
+        return True
+    if isinstance(condition, str):
+        return value == condition
+    return value in condition
+
+
+class ProbabilityEngine:
+    """
+    Computes exact probabilities of the characters produced by generate_character, without generating any.
+
+    Characters are generated by picking gender, alignment, race and class uniformly, then a subrace (subclass)
+    uniformly among those of the race (class), ability scores according to the method, and a deity uniformly
+    among those the character may worship. The engine sums over every race, subrace, class and subclass
+    combination, using the choice tables of the compiled dataset, so results are exact fractions.
+
+    Conditions are given as keyword arguments:
+     * gender, alignment, race, subrace, classname, subclass, deity: a value, or a collection of accepted values,
+     * scores: a dictionary of bounds on final ability scores (racial bonuses included), by ability:
+       a minimum (eg. {'STR': 16}) or a (minimum, maximum) pair, None meaning no bound.
+
+    Example: ProbabilityEngine().probability(race='Half-Orc', classname='Fighter', scores={'STR': 16})
+    """
+
+    def __init__(self, dataset=None, method='roll'):
+        self.dataset = dataset or load_dataset()
+        self.method = method
+
+        dataset = self.dataset
+        self.abilities = tuple(dataset['ability_scores'])
+
+        # Probability of each (race, subrace) and (class, subclass) pair
+        self.race_pairs = tuple(
+            (race, subrace, Fraction(1, len(dataset.race_names) * len(dataset.subrace_choices[race])))
+            for race in dataset.race_names for subrace in dataset.subrace_choices[race]
+            )
+        self.class_pairs = tuple(
+            (classname, subclass, Fraction(1, len(dataset.class_names) * len(dataset.subclass_choices[classname])))
+            for classname in dataset.class_names for subclass in dataset.subclass_choices[classname]
+            )
+
+    def bounds(self, scores):
+        bounds = {}
+        for ability, bound in (scores or {}).items():
+            if ability not in self.abilities:
+                raise KeyError('Unknown ability: {}'.format(ability))
+            bounds[ability] = bound if isinstance(bound, tuple) else (bound, None)
+
+        return tuple(bounds.get(ability, (None, None)) for ability in self.abilities)
+
+    def joint(self, attribute=None, gender=None, alignment=None, race=None, subrace=None, classname=None, subclass=None,
+              deity=None, scores=None):
+        """
+        Returns the probability of the conditions, split by value of an attribute (one of CATEGORIES or an ability),
+        as a dictionary of probabilities by value ({None: probability} if attribute is None).
+        """
+        dataset = self.dataset
+        bounds = self.bounds(scores)
+        ability = self.abilities.index(attribute) if attribute in self.abilities else None
+
+        if attribute is not None and ability is None and attribute not in CATEGORIES:
+            raise KeyError('Unknown attribute: {}'.format(attribute))
+
+        # Gender and alignment are independent from everything else
+        genders = [value for value in GENDERS if accepts(gender, value)]
+        alignments = [value for value in dataset['alignments'] if accepts(alignment, value)]
+        core = Fraction(len(genders), len(GENDERS)) * Fraction(len(alignments), len(dataset['alignments']))
+
+        # Class and subclass are independent from race, subrace and ability scores, unless deities are involved
+        classes = [(classname_, subclass_, p) for classname_, subclass_, p in self.class_pairs
+                   if accepts(classname, classname_) and accepts(subclass, subclass_)]
+        with_deity = deity is not None or attribute == 'deity'
+
+        def class_outcomes(race_, subrace_):
+            # Probability of the class, subclass and deity conditions, by value of the attribute of interest
+            outcomes = Counter()
+
+            for classname_, subclass_, p in classes:
+                value = {'class': classname_, 'subclass': subclass_}.get(attribute)
+
+                if not with_deity:
+                    outcomes[value] += p
+                    continue
+
+                pool = dataset.deity_choices.get((race_, subrace_, classname_, subclass_), ())
+
+                if not pool:
+                    # Characters without any deity only satisfy the absence of condition on deities
+                    if deity is None:
+                        outcomes[value] += p
+                    continue
+
+                accepted = [deity_ for deity_ in pool if accepts(deity, deity_)]
+
+                if attribute == 'deity':
+                    for deity_ in accepted:
+                        outcomes[deity_] += p / len(pool)
+                elif accepted:
+                    outcomes[value] += p * len(accepted) / len(pool)
+
+            return outcomes
+
+        shared_class_outcomes = None if with_deity else class_outcomes(None, None)
+
+        outcomes = Counter()
+
+        for race_, subrace_, p_race in self.race_pairs:
+            if not (accepts(race, race_) and accepts(subrace, subrace_)):
+                continue
+
+            score_outcomes = score_distribution(self.method, dataset.ability_bonuses[(race_, subrace_)], bounds, ability)
+            race_value = {'race': race_, 'subrace': subrace_}.get(attribute)
+
+            race_class_outcomes = class_outcomes(race_, subrace_) if with_deity else shared_class_outcomes
+
+            for class_value, p_class in race_class_outcomes.items():
+                for score, p_scores in score_outcomes.items():
+                    p = core * p_race * p_class * p_scores
+                    value = score if ability is not None else race_value or class_value
+
+                    # Gender and alignment are uniform among accepted values
+                    if attribute == 'gender':
+                        for gender_ in genders:
+                            outcomes[gender_] += p / len(genders)
+                    elif attribute == 'alignment':
+                        for alignment_ in alignments:
+                            outcomes[alignment_] += p / len(alignments)
+                    else:
+                        outcomes[value] += p
+
+        return {value: p for value, p in outcomes.items() if p}
+
+    def probability(self, **conditions):
+        """
+        Returns the exact probability that a generated character satisfies every condition, as a Fraction.
+        """
+        return sum(self.joint(**conditions).values(), Fraction(0))
+
+    def conditional(self, event, given):
+        """
+        Returns the probability of an event (a dictionary of conditions) given other conditions (eg. the race and class).
+        """
+        given_p = self.probability(**given)
+
+        if not given_p:
+            raise ZeroDivisionError('The conditions cannot be satisfied: {}'.format(given))
+
+        both = dict(given)
+        for name, condition in event.items():
+            if name == 'scores' and not set(condition) & set(given.get('scores', {})):
+                both['scores'] = {**given.get('scores', {}), **condition}
+            elif name in given:
+                raise ValueError('{} appears both in the event and in the conditions'.format(name))
+            else:
+                both[name] = condition
+
+        return self.probability(**both) / given_p
+
+    def distribution(self, attribute, **conditions):
+        """
+        Returns the distribution of an attribute (eg. 'subrace', 'deity' or 'STR') given the conditions,
+        as a dictionary of probabilities by value.
+        """
+        outcomes = self.joint(attribute, **conditions)
+        total = sum(outcomes.values())
+
+        if not total:
+            raise ZeroDivisionError('The conditions cannot be satisfied: {}'.format(conditions))
+
+        return {value: p / total for value, p in outcomes.items()}
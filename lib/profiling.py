@@ -0,0 +1,83 @@
+import bisect
+import json
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in microseconds (the last bucket has no upper bound)
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class StageTimer:
+    """
+    Times the successive stages of a single call: each lap records the time elapsed since the previous one.
+    """
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.start = self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.profiler.record(stage, now - self.last)
+        self.last = now
+
+    def finish(self, stage='total'):
+        self.profiler.record(stage, time.perf_counter() - self.start)
+
+
+class StageProfiler:
+    """
+    Collects call counts and latency histograms per stage, safely across threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+
+    def timer(self):
+        """
+        Returns a StageTimer to time the stages of one call.
+        """
+        return StageTimer(self)
+
+    def record(self, stage, seconds):
+        """
+        Records one run of a stage that lasted a given number of seconds.
+        """
+        micros = seconds * 1e6
+        bucket = bisect.bisect_left(BUCKETS, micros)
+
+        with self._lock:
+            stats = self._stages.get(stage)
+
+            if stats is None:
+                stats = self._stages[stage] = {'count': 0, 'total': 0.0, 'max': 0.0, 'histogram': [0] * (len(BUCKETS) + 1)}
+
+            stats['count'] += 1
+            stats['total'] += micros
+            stats['max'] = max(stats['max'], micros)
+            stats['histogram'][bucket] += 1
+
+    def snapshot(self):
+        """
+        Returns the statistics collected so far, for each stage:
+        call count, total, mean and max latency (in microseconds) and the number of calls per latency bucket.
+        """
+        labels = ['<={}us'.format(bound) for bound in BUCKETS] + ['>{}us'.format(BUCKETS[-1])]
+
+        with self._lock:
+            return {
+                stage: {
+                    'count': stats['count'],
+                    'total_us': stats['total'],
+                    'mean_us': stats['total'] / stats['count'],
+                    'max_us': stats['max'],
+                    'histogram': dict(zip(labels, stats['histogram'])),
+                }
+                for stage, stats in self._stages.items()
+            }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
@@ -0,0 +1,170 @@
+import collections
+import logging
+import threading
+import time
+
+from lib.character_generator import generate_character
+
+
+class CharacterReservoir:
+    """
+    Keeps fully generated characters (attribute_dict included) ready to be served in constant time.
+
+    A background thread refills the reservoir in bursts: when the number of characters falls below the low watermark,
+    characters are generated until the reservoir holds high_watermark characters again. Popping from an empty
+    reservoir (a miss) generates a character on the spot.
+
+    Args:
+     * method: the ability score method ('roll' or 'standard'),
+     * high_watermark: the number of characters the reservoir is filled up to,
+     * low_watermark: refills start when fewer characters are left (a quarter of high_watermark by default),
+     * factory: function generating a character (generate_character(method) by default),
+     * prepare: optional function applied to each character by the refill thread (eg. decoding its avatar),
+     * error_delay: time to wait (in seconds) after the refill thread failed to generate a character, before trying again.
+
+    Errors raised by factory or prepare in the refill thread are logged and counted (see metrics), without stopping it.
+
+    Usage:
+        with CharacterReservoir('roll', 64) as reservoir:
+            character = reservoir.pop()
+    """
+
+    def __init__(self, method='roll', high_watermark=32, low_watermark=None, factory=None, prepare=None, error_delay=0.1):
+        if low_watermark is None:
+            low_watermark = max(1, high_watermark // 4)
+
+        if not 1 <= low_watermark <= high_watermark:
+            raise ValueError('Watermarks must satisfy 1 <= low <= high (got {} and {})'.format(low_watermark, high_watermark))
+
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.factory = factory or (lambda: generate_character(method))
+        self.prepare = prepare
+        self.error_delay = error_delay
+
+        self._characters = collections.deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+        # Time the reservoir fell below the low watermark, while a refill is pending or running
+        self._below_since = None
+
+        self._hits = self._misses = self._refills = self._generated = self._errors = 0
+        self._last_error = None
+        self._lag_total = self._lag_max = self._lag_last = 0.0
+
+    def start(self):
+        """
+        Starts the refill thread, which fills the reservoir right away.
+        """
+        with self._condition:
+            self._stopped = False
+            self._below_since = time.perf_counter()
+
+        self._thread = threading.Thread(target=self._refill, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        """
+        Stops the refill thread (after the character being generated, if any).
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def __len__(self):
+        return len(self._characters)
+
+    def pop(self):
+        """
+        Returns a ready character if any (a hit), or generates one (a miss).
+        """
+        with self._condition:
+            if self._characters:
+                character = self._characters.popleft()
+                self._hits += 1
+            else:
+                character = None
+                self._misses += 1
+
+            if len(self._characters) < self.low_watermark and self._below_since is None and not self._stopped:
+                self._below_since = time.perf_counter()
+                self._condition.notify()
+
+        return character if character is not None else self.factory()
+
+    def _refill(self):
+        while True:
+            with self._condition:
+                while self._below_since is None and not self._stopped:
+                    self._condition.wait()
+
+                if self._stopped:
+                    return
+
+            # Characters are generated outside of the lock, so that pop never waits for them
+            try:
+                character = self.factory()
+                character.attribute_dict # Rendered now rather than when the character is popped
+                if self.prepare:
+                    self.prepare(character)
+
+            except Exception as error:
+                logging.exception('Reservoir refill failed')
+
+                with self._condition:
+                    self._errors += 1
+                    self._last_error = repr(error)
+
+                    # Wait before trying again (unless stopped), so that a persistent failure does not spin
+                    if not self._stopped:
+                        self._condition.wait(self.error_delay)
+                continue
+
+            with self._condition:
+                self._characters.append(character)
+                self._generated += 1
+
+                if len(self._characters) >= self.high_watermark:
+                    lag = time.perf_counter() - self._below_since
+                    self._below_since = None
+                    self._refills += 1
+                    self._lag_total += lag
+                    self._lag_max = max(self._lag_max, lag)
+                    self._lag_last = lag
+
+    def metrics(self):
+        """
+        Returns the reservoir statistics: current size, hits, misses and hit rate, completed refills, characters generated
+        in the background, refill errors (and the last one), and refill lag (time from falling below the low watermark
+        to reaching the high watermark, in seconds): last, mean and max.
+        """
+        with self._condition:
+            requests = self._hits + self._misses
+
+            return {
+                'size': len(self._characters),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / requests if requests else None,
+                'refills': self._refills,
+                'generated': self._generated,
+                'errors': self._errors,
+                'last_error': self._last_error,
+                'refill_lag_last': self._lag_last,
+                'refill_lag_mean': self._lag_total / self._refills if self._refills else None,
+                'refill_lag_max': self._lag_max,
+            }
@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from lib.character_generator import generate_character, load_dataset, render_chunk
+from lib.exporter import character_to_dict
+
+HOST = '127.0.0.1'
+PORT = 8000
+
+# Largest batch returned at once (larger rosters should be streamed), and largest stream
+MAX_BATCH = 10000
+MAX_STREAM = 10**7
+
+# Characters generated per worker task when serving batches and streams
+CHUNK_SIZE = 500
+
+# Requests with a larger head are rejected
+MAX_HEAD_SIZE = 8192
+
+
+class RequestError(Exception):
+    """
+    Error answered with an HTTP status and a JSON message.
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def warm_up():
+    """
+    Loads the dataset once in each worker process, before the first request.
+    """
+    load_dataset()
+
+
+class CharacterServer:
+    """
+    HTTP service generating characters, with a warm dataset and a pool of worker processes.
+
+    Endpoints (GET):
+     * /character?method=roll[&id=ID]: one character, as a JSON object (the same ID always gives back the same character),
+     * /characters?count=N&method=roll[&seed=S]: a batch of up to MAX_BATCH characters, as a JSON array,
+     * /stream?count=N&method=roll[&seed=S]: a roster streamed as JSON lines, using chunked transfer encoding.
+
+    Batches and streams are rosters (see lib.character_generator.generate_roster): the same seed always gives
+    the same characters. They are generated by the worker pool, CHUNK_SIZE characters per task.
+    """
+
+    def __init__(self, workers=os.cpu_count(), chunk_size=CHUNK_SIZE):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.executor = None
+
+    async def start(self, host=HOST, port=PORT):
+        load_dataset()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up)
+        return await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEAD_SIZE)
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(cancel_futures=True)
+
+    # Connections
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serves the requests of a connection, until the client closes it (connections are kept alive).
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.LimitOverrunError:
+                    await self.send_error(writer, RequestError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, 'Request head too large'))
+                    break
+                except asyncio.IncompleteReadError:
+                    break
+
+                keep_alive = await self.handle_request(head.decode('latin-1'), writer)
+                if not keep_alive:
+                    break
+
+        except ConnectionError:
+            pass
+
+        finally:
+            writer.close()
+
+    async def handle_request(self, head, writer):
+        """
+        Answers one request. Returns whether the connection can be kept alive.
+        """
+        request_line, *header_lines = head.rstrip('\r\n').split('\r\n')
+        headers = dict(line.lower().split(':', 1) for line in header_lines if ':' in line)
+        keep_alive = headers.get('connection', '').strip() != 'close'
+
+        try:
+            method, target, version = request_line.split(' ')
+            if method != 'GET':
+                raise RequestError(HTTPStatus.METHOD_NOT_ALLOWED, 'Only GET requests are supported')
+
+            url = urlsplit(target)
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            route = self.routes().get(url.path)
+
+            if route is None:
+                raise RequestError(HTTPStatus.NOT_FOUND, 'Unknown endpoint: {}'.format(url.path))
+
+            await route(query, writer)
+
+        except RequestError as error:
+            await self.send_error(writer, error)
+
+        except ValueError:
+            await self.send_error(writer, RequestError(HTTPStatus.BAD_REQUEST, 'Malformed request'))
+
+        return keep_alive
+
+    def routes(self):
+        return {
+            '/character': self.single,
+            '/characters': self.batch,
+            '/stream': self.stream,
+        }
+
+    # Responses
+
+    async def send(self, writer, status, body, content_type='application/json'):
+        body = body.encode()
+        writer.write(
+            'HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n\r\n'.format(
+                status.value, status.phrase, content_type, len(body)
+            ).encode() + body
+        )
+        await writer.drain()
+
+    async def send_error(self, writer, error):
+        await self.send(writer, error.status, json.dumps({'error': str(error)}))
+
+    # Endpoints
+
+    async def single(self, query, writer):
+        method = parse_method(query)
+        character_id = parse_int(query, 'id', None, 0, 2**64 - 1)
+
+        # A single character is generated in a few tens of microseconds: faster here than in a worker process
+        character = generate_character(method, character_id)
+        await self.send(writer, HTTPStatus.OK, json.dumps(character_to_dict(character)))
+
+    async def batch(self, query, writer):
+        method = parse_method(query)
+        count = parse_int(query, 'count', 1, 1, MAX_BATCH)
+        seed = parse_int(query, 'seed', random.getrandbits(32), 0, 2**32 - 1)
+
+        lines = ''.join([chunk async for chunk in self.generate_chunks(count, method, seed)]).splitlines()
+        await self.send(writer, HTTPStatus.OK, '[' + ','.join(lines) + ']')
+
+    async def stream(self, query, writer):
+        method = parse_method(query)
+        count = parse_int(query, 'count', 1, 1, MAX_STREAM)
+        seed = parse_int(query, 'seed', random.getrandbits(32), 0, 2**32 - 1)
+
+        writer.write(
+            'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n'.encode()
+        )
+
+        async for chunk in self.generate_chunks(count, method, seed):
+            data = chunk.encode()
+            writer.write('{:x}\r\n'.format(len(data)).encode() + data + b'\r\n')
+            # Wait for the client to read the chunk, so that a slow client does not make the server buffer the whole roster
+            await writer.drain()
+
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    async def generate_chunks(self, count, method, seed):
+        """
+        Yields the JSON lines of a roster, chunk by chunk, in order. At most two chunks per worker are pending at any time.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = iter(
+            (start, min(self.chunk_size, count - start), method, seed, 'jsonl') for start in range(0, count, self.chunk_size)
+            )
+        pending = []
+
+        for chunk in chunks:
+            pending.append(loop.run_in_executor(self.executor, render_chunk, chunk))
+            if len(pending) >= 2 * self.workers:
+                yield await pending.pop(0)
+
+        for future in pending:
+            yield await future
+
+
+def parse_method(query):
+    method = query.get('method', 'roll')
+    if method not in ('roll', 'standard'):
+        raise RequestError(HTTPStatus.BAD_REQUEST, "method must be 'roll' or 'standard'")
+    return method
+
+
+def parse_int(query, name, default, low, high):
+    if name not in query:
+        return default
+
+    try:
+        value = int(query[name], 0)
+    except ValueError:
+        value = None
+
+    if value is None or not low <= value <= high:
+        raise RequestError(HTTPStatus.BAD_REQUEST, '{} must be an integer between {} and {}'.format(name, low, high))
+
+    return value
+
+
+async def serve(host=HOST, port=PORT, workers=os.cpu_count()):
+    server = CharacterServer(workers)
+
+    try:
+        async with await server.start(host, port) as listener:
+            print('Serving characters on http://{}:{}'.format(host, port))
+            await listener.serve_forever()
+
+    finally:
+        server.close()
+
+
+def main(argv=None):
+    """
+    Command line entry point: python -m lib.server [--port 8000] [--workers 4]
+    """
+    parser = argparse.ArgumentParser(description='Serve random D&D 5E player characters over HTTP.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes generating batches and streams')
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
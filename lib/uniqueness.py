@@ -0,0 +1,239 @@
+import hashlib
+import itertools
+import math
+
+from lib.character_generator import ROLL_SCORES, STANDARD_PERMUTATIONS, generate_character, load_dataset, make_character_id
+
+# Final ability scores are stored in 5 bits each in fingerprints
+SCORE_RADIX = 32
+
+# Default false positive rate of Bloom filters
+ERROR_RATE = 0.001
+
+# Generation stops when that many characters in a row are duplicates
+MAX_REJECTIONS = 1000
+
+
+class SpaceExhausted(RuntimeError):
+    """
+    Raised when unique characters can no longer be found in a reasonable number of attempts.
+    """
+
+
+def fingerprint(character, dataset):
+    """
+    Returns an integer identifying the build of a character: race, subrace, class, subclass, deity and final ability scores
+    (two characters only differing by their gender, alignment or skills have the same fingerprint).
+
+    Categorical attributes are packed as their codes into the dataset vocabularies, so fingerprints are exact (no collisions).
+    """
+    codes = dataset.codes
+    key = 0
+
+    for field, value in (('race', character.race), ('subrace', character.subrace),
+                         ('class', character.classname), ('subclass', character.subclass)):
+        key = key * len(codes[field]) + codes[field][value]
+
+    # Characters without a deity get code 0
+    deity = getattr(character, 'deity', None)
+    key = key * (len(codes['deity']) + 1) + (0 if deity is None else codes['deity'][deity] + 1)
+
+    for ability in dataset['ability_scores']:
+        key = key * SCORE_RADIX + character.ability_scores[ability]
+
+    return key
+
+
+def combination_space(method='roll', dataset=None, constraints=None):
+    """
+    Returns the number of distinct builds (see fingerprint) generate_character can produce with an ability score method,
+    or that satisfy the conditions of a lib.constraints.Constraints object (its method and dataset are then used).
+    """
+    if constraints is not None:
+        dataset, method = constraints.dataset, constraints.method
+        space = 0
+
+        for race, subrace, classname, subclass, deities in constraints.combinations:
+            table = constraints.score_tables[(race, subrace)]
+            scores = math.prod(len(rolls) for rolls, _ in table) if method == 'roll' else len(table)
+
+            if deities is None:
+                deities = dataset.deity_choices.get((race, subrace, classname, subclass), ())
+
+            space += scores * max(1, len(deities))
+
+        return space
+
+    dataset = dataset or load_dataset()
+
+    if method == 'roll':
+        scores = len(ROLL_SCORES) ** len(dataset['ability_scores'])
+    elif method == 'standard':
+        scores = len(STANDARD_PERMUTATIONS)
+    else:
+        raise ValueError('Unknown ability score method: {}'.format(method))
+
+    builds = sum(
+        max(1, len(dataset.deity_choices.get((race, subrace, classname, subclass), ())))
+        for race in dataset.race_names for subrace in dataset.subrace_choices[race]
+        for classname in dataset.class_names for subclass in dataset.subclass_choices[classname]
+        )
+
+    return builds * scores
+
+
+class BloomFilter:
+    """
+    Set of integers in a fixed amount of memory (about 1.8 bytes per item for a 0.1% error rate, instead of ~70 bytes in a set).
+
+    Membership tests have no false negatives, but may have false positives: at the expected capacity,
+    an item never added is reported as present with probability error_rate.
+    """
+
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / max(1, capacity) * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return len(self.bits)
+
+    def positions(self, key):
+        # Double hashing: k positions from two 64-bit hashes
+        digest = hashlib.blake2b(key.to_bytes(16, 'little'), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] >> (position & 7) & 1 for position in self.positions(key))
+
+    def add(self, key):
+        """
+        Adds an integer. Returns False if it was (or may have been) added before.
+        """
+        added = False
+
+        for position in self.positions(key):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+
+        self.count += added
+        return added
+
+
+class UniquenessIndex:
+    """
+    Index of the builds already generated, rejecting duplicates (see fingerprint) in constant time.
+
+    Args:
+     * method, dataset, constraints: what characters are generated with, to size the combination space (see combination_space),
+     * mode: 'set' to store exact fingerprints, or 'bloom' to store them in a Bloom filter for very large rosters
+       (unique builds are then rejected with probability error_rate at most, but never duplicates),
+     * capacity: the expected number of characters (required by the 'bloom' mode),
+     * error_rate: the false positive rate of the Bloom filter.
+    """
+
+    def __init__(self, method='roll', dataset=None, constraints=None, mode='set', capacity=None, error_rate=ERROR_RATE):
+        self.dataset = constraints.dataset if constraints is not None else dataset or load_dataset()
+        self.space = combination_space(method, self.dataset, constraints)
+        self.mode = mode
+        self.rejected = 0
+
+        if mode == 'set':
+            self.fingerprints = set()
+        elif mode == 'bloom':
+            if capacity is None:
+                raise ValueError('The bloom mode needs the expected number of characters (capacity)')
+            self.fingerprints = BloomFilter(capacity, error_rate)
+        else:
+            raise ValueError("mode must be 'set' or 'bloom' (got {})".format(mode))
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def add(self, character):
+        """
+        Records the build of a character. Returns False (and records nothing) if it is a duplicate.
+        """
+        key = fingerprint(character, self.dataset)
+        fingerprints = self.fingerprints
+
+        if self.mode == 'set':
+            size = len(fingerprints)
+            fingerprints.add(key)
+            added = len(fingerprints) > size
+        else:
+            added = fingerprints.add(key)
+
+        self.rejected += not added
+        return added
+
+    def remaining(self):
+        """
+        Returns the number of builds not generated yet.
+        """
+        return self.space - len(self)
+
+
+def generate_unique_roster(count, method, seed, mode='set', constraints=None, first=0, error_rate=ERROR_RATE,
+                           max_rejections=MAX_REJECTIONS):
+    """
+    Generates count characters of a roster (see lib.character_generator.generate_roster) with no duplicate build,
+    skipping characters whose build was already generated. Kept characters can still be generated again from their ID.
+
+    Characters satisfy the conditions of a lib.constraints.Constraints object, if provided (its method is then used):
+    they then have no character ID, and can only be generated again with the same conditions (see Constraints.generate).
+
+    Raises ValueError right away if fewer than count builds exist, and SpaceExhausted as soon as max_rejections
+    characters in a row are duplicates (the remaining builds are then too rare to be found by sampling).
+    """
+    index = UniquenessIndex(method, constraints=constraints, mode=mode, capacity=count, error_rate=error_rate)
+
+    if count > index.space:
+        raise ValueError('Only {:,} distinct builds exist, {:,} requested'.format(index.space, count))
+
+    if constraints is not None:
+        generate = constraints.generate
+    else:
+        generate = lambda character_id: generate_character(method, character_id)
+
+    rejections = 0
+
+    for position in itertools.count(first):
+        character = generate(make_character_id(seed, position))
+
+        if index.add(character):
+            yield character
+            rejections = 0
+
+            if len(index) == count:
+                return
+
+        else:
+            rejections += 1
+            if rejections >= max_rejections:
+                raise SpaceExhausted('{} duplicates in a row after {:,} unique characters ({:,} builds left out of {:,})'.format(
+                    rejections, len(index), index.remaining(), index.space))
+
+
+def generate_unique_chunks(count, method, seed, mode='set', chunk_size=1000, file_format='text', first=0):
+    """
+    Generates a roster with no duplicate build (see generate_unique_roster), rendered chunk_size characters at a time
+    with a lib.exporter renderer. Duplicates can only be found in order, so this runs in a single process.
+    """
+    from lib.exporter import RENDERERS
+
+    characters = generate_unique_roster(count, method, seed, mode, first=first)
+
+    while True:
+        chunk = list(itertools.islice(characters, chunk_size))
+        if not chunk:
+            return
+        yield RENDERERS[file_format](chunk)
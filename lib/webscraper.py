@@ -1,165 +1,432 @@
 # Utilities
 import logging
-import time
 import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin
 
-# Webscraping 
-from selenium import webdriver # !pip install selenium
-from selenium.webdriver.common.by import By
-from selenium.common.exceptions import NoSuchElementException, InvalidArgumentException
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager # !pip install webdriver_manager
+# Webscraping
+# Selenium (!pip install selenium webdriver_manager) is only imported when scraping with a browser (mode='browser'),
+# static pages being downloaded with requests and parsed with the standard library
+from lib.api_request import TIMEOUT, make_session
 
+WIKI_URL = "https://forgottenrealms.fandom.com/wiki/"
 
-def load_wiki_main_page(sleep_time=5):
+# Number of pantheons scraped in parallel (and of Chrome instances started at most, in browser mode)
+MAX_WORKERS = 4
+
+# Maximum time to wait for a page to be ready (in seconds)
+WAIT_TIMEOUT = 10
+
+# Elements parsed from category and deity pages, waited for in browser mode (deity pages without 5E tab still have an infobox)
+CATEGORY_READY = '.category-page__member-link'
+DEITY_READY = '[data-item-name*=edition5], .portable-infobox'
+
+# HTML elements without end tag
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+
+## HTML PARSERS ##
+
+class CategoryPageParser(HTMLParser):
+
+    """
+    Collects the name and url of the pages listed in a wiki category page (links with the category-page__member-link class).
+    """
+
+    def __init__(self, base_url=WIKI_URL):
+        super().__init__()
+        self.base_url = base_url
+        self.links = []
+        self._href = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'a' and 'category-page__member-link' in (attrs.get('class') or '').split():
+            self._href = urljoin(self.base_url, attrs.get('href') or '')
+            self._text = []
+
+    def handle_data(self, data):
+        if self._href is not None:
+            self._text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._href is not None:
+            self.links.append((' '.join(''.join(self._text).split()), self._href))
+            self._href = None
+
+
+class DeityPageParser(HTMLParser):
 
     """
-    Loads the home page from the Forgotten Realms Fandom Wiki.
+    Collects the 5th edition alignment and domains from the infobox of a deity page.
+
+    The infobox fields are elements whose data-source attribute contains alignment5e / domains5e,
+    their value being the text of the first div they contain, as rendered by a browser: whitespace is collapsed,
+    <br> tags break lines, and citation markers (eg. [1]) are kept, as in dataset.json.
     """
-    
+
+    FIELDS = ('alignment5e', 'domains5e')
+
+    def __init__(self):
+        super().__init__()
+        self.has_5e = False
+        self.values = {}
+        self._field = None
+        self._field_depth = None
+        self._depth = 0
+        self._value_depth = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+
+        if 'edition5' in (attrs.get('data-item-name') or ''):
+            self.has_5e = True
+
+        if tag in VOID_TAGS:
+            if tag == 'br' and self._value_depth is not None:
+                self._text.append('\n')
+            return
+
+        self._depth += 1
+        source = attrs.get('data-source') or ''
+
+        if self._field is None:
+            for field in self.FIELDS:
+                if field in source and field not in self.values:
+                    self._field, self._field_depth = field, self._depth
+
+        elif tag == 'div' and self._value_depth is None:
+            self._value_depth, self._text = self._depth, []
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_data(self, data):
+        if self._value_depth is not None:
+            # Whitespace is collapsed as in the rendered page, only <br> tags breaking lines
+            self._text.append(re.sub(r'\s+', ' ', data))
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS:
+            return
+
+        if self._value_depth == self._depth:
+            self.values[self._field] = '\n'.join(line.strip() for line in ''.join(self._text).strip().split('\n'))
+            self._value_depth = None
+
+        if self._field is not None and self._field_depth == self._depth:
+            self._field = None
+
+        self._depth -= 1
+
+
+def parse_category_page(html:str, base_url=WIKI_URL):
+
+    """
+    Extracts the deities listed in a pantheon category page.
+
+    Returns: a dictionary of deity - url pairs (subcategories, ie. other pantheons, are skipped).
+    """
+    parser = CategoryPageParser(base_url)
+    parser.feed(html)
+    parser.close()
+
+    return {name: url for name, url in parser.links if 'Category:' not in name}
+
+
+def parse_deity_page(html:str):
+
+    """
+    Extracts the 5th edition alignment and domains of a deity from its page.
+
+    Returns: a dictionary with the deity alignment and domains, or None if the page has no 5E tab.
+    """
+    parser = DeityPageParser()
+    parser.feed(html)
+    parser.close()
+
+    if not parser.has_5e:
+        return None
+
+    domains = parser.values.get('domains5e')
+
+    return {
+        'deity_alignment': parser.values.get('alignment5e', ''),
+        'deity_domains': domains.split(',\n') if domains else '',
+    }
+
+
+## PAGE LOADERS ##
+
+class StaticLoader:
+
+    """
+    Downloads pages with a shared requests session (pages are scraped without JavaScript anyway).
+
+    Local files (saved pages) can be loaded as well, from a path or a file:// url.
+    """
+
+    def __init__(self):
+        self.session = make_session(MAX_WORKERS)
+
+    def get(self, url:str, ready=None):
+        # ready (the elements to wait for in browser mode) is not needed: pages are downloaded whole
+        if url.startswith('file://'):
+            url = url[len('file://'):]
+
+        if os.path.exists(url):
+            with open(url, 'r', encoding='utf-8') as html_file:
+                return html_file.read()
+
+        response = self.session.get(url, timeout=TIMEOUT)
+        response.raise_for_status()
+
+        # Wiki pages are encoded in UTF-8 (requests assumes ISO-8859-1 when the charset is not specified)
+        if 'charset' not in response.headers.get('Content-Type', ''):
+            response.encoding = 'utf-8'
+
+        return response.text
+
+    def close(self):
+        self.session.close()
+
+
+class BrowserLoader:
+
+    """
+    Loads pages in Chrome, from a pool of up to max_drivers browsers shared by every worker thread.
+
+    Each page load checks a browser out of the pool and returns it afterwards, so browsers are started on first use only
+    and reused by later calls, whichever thread they run in (eg. get_deity_details reuses those of get_deity_url).
+    """
+
+    def __init__(self, timeout=WAIT_TIMEOUT, max_drivers=MAX_WORKERS):
+        self.timeout = timeout
+        self.max_drivers = max_drivers
+        self._idle = queue.Queue()
+        self._drivers = []
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def checkout(self):
+        try:
+            return self._idle.get_nowait()
+
+        except queue.Empty:
+            with self._lock:
+                start = self._started < self.max_drivers
+                self._started += start
+
+            if not start:
+                # Every browser is busy: wait for one to be returned
+                return self._idle.get()
+
+            try:
+                driver = load_wiki_main_page(self.timeout)[1]
+
+            except Exception:
+                with self._lock:
+                    self._started -= 1
+                raise
+
+            with self._lock:
+                self._drivers.append(driver)
+
+            return driver
+
+    def get(self, url:str, ready=None):
+        driver = self.checkout()
+
+        try:
+            driver.get(url)
+            wait_until_ready(driver, self.timeout, ready)
+            return driver.page_source
+
+        finally:
+            self._idle.put(driver)
+
+    def close(self):
+        with self._lock:
+            drivers, self._drivers, self._started = self._drivers, [], 0
+            self._idle = queue.Queue()
+
+        for driver in drivers:
+            driver.quit()
+
+
+def wait_until_ready(driver, timeout=WAIT_TIMEOUT, selector=None):
+
+    """
+    Waits until the page loaded in the driver contains an element matching a CSS selector (eg. CATEGORY_READY),
+    instead of sleeping for a fixed time. Pages without such element are returned as they are after the timeout.
+
+    Without selector, only checks that the document is loaded, which driver.get already waits for
+    (with the default page load strategy): it is then a mere load check.
+    """
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    if selector is None:
+        WebDriverWait(driver, timeout).until(lambda driver: driver.execute_script('return document.readyState') == 'complete')
+        return
+
+    try:
+        WebDriverWait(driver, timeout).until(expected_conditions.presence_of_element_located((By.CSS_SELECTOR, selector)))
+
+    except TimeoutException:
+        logging.warning('No element matching {} in {}'.format(selector, driver.current_url))
+
+
+def make_loader(mode='browser', timeout=WAIT_TIMEOUT):
+
+    if mode == 'static':
+        return StaticLoader()
+
+    if mode == 'browser':
+        return BrowserLoader(timeout)
+
+    raise ValueError("Unknown scraping mode: {} (expected 'static' or 'browser')".format(mode))
+
+
+def load_wiki_main_page(timeout=WAIT_TIMEOUT):
+
+    """
+    Loads the home page from the Forgotten Realms Fandom Wiki in Chrome.
+    """
+    from selenium import webdriver # !pip install selenium
+    from selenium.webdriver.common.by import By
+    from selenium.common.exceptions import NoSuchElementException
+    from selenium.webdriver.chrome.service import Service
+    from webdriver_manager.chrome import ChromeDriverManager # !pip install webdriver_manager
+
     # Silence webdriver download
     logging.getLogger('WDM').setLevel(logging.NOTSET)
     os.environ['WDM_LOG'] = 'False'
 
     # Define url and driver
-    page_url = "https://forgottenrealms.fandom.com/wiki/"
-    
+    page_url = WIKI_URL
+
     chrome_options = webdriver.ChromeOptions()
     prefs = {
         "profile.managed_default_content_settings.images": 2, # Optional - disables image loading
         'profile.managed_default_content_settings.javascript': 2 # Optional - disables Javascript
-    } 
-    
+    }
+
     chrome_options.add_experimental_option("prefs", prefs)
-    
+
     driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-    
+
     # Go to the wiki main page and wait for it to load
     driver.get(page_url)
-    time.sleep(sleep_time)
+    wait_until_ready(driver, timeout)
 
     # Enable cookies (if necessary)
     try:
         driver.find_element(By.XPATH, '//div[text()="ACCEPT"]').click()
-        
+
     except NoSuchElementException:
         pass
-    
+
     return page_url, driver
 
 
-def get_deity_url(in_list=list, verbose=False, sleep_time=5):
-      
+## MAIN FUNCTIONS ##
+
+def scrape_pantheons(pantheons:list, scrape, loader, max_workers=MAX_WORKERS):
+
+    """
+    Runs scrape(loader, pantheon) for each pantheon, max_workers pantheons at a time.
+
+    Returns: a dictionary of results by pantheon, in the order of pantheons.
+    """
+    if max_workers <= 1:
+        return {pantheon: scrape(loader, pantheon) for pantheon in pantheons}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda pantheon: scrape(loader, pantheon), pantheons)
+        return dict(zip(pantheons, results))
+
+
+def get_deity_url(in_list=list, verbose=False, mode='browser', max_workers=MAX_WORKERS, loader=None):
+
     """
     Collects data from the Forgotten Realms Fandom Wiki.
 
-    Args: a list of pantheons to browse through.
-     
+    Args: a list of pantheons to browse through,
+    and optionally the scraping mode ('browser' to use Chrome, 'static' to download pages without a browser),
+    the number of pantheons scraped in parallel (max_workers) and a page loader to reuse (see make_loader).
+
     Returns: a nested dictionary providing for each pantheon, their deities and respective url.
     """
-    
-    out_dict = {}
-                    
-    #Define url and driver
-    page_url, driver = load_wiki_main_page()
-
-
-    # Go to the pantheon url and wait for the page to load
-    for pantheon in in_list:
-        
-        out_dict[pantheon] = {}
-
-        driver.get(page_url+'Category:'+pantheon)
-        time.sleep(sleep_time)
-    
-        # Extract all found deities and their url
-        target = driver.find_elements(By.CLASS_NAME, value="category-page__member-link")
-    
-        for deity in target:
-            if 'Category:' not in deity.text: #skips the entries that are pantheons and not individual deities
-                
-                out_dict[pantheon].update({
-                    deity.text : deity.get_attribute('href')
-                })
-                
-                if verbose:
-                    print('{} from {} successfully added'.format(deity.text, pantheon)) # Strip the 'Category:' prefix
-                    
-    return out_dict
 
+    def scrape(loader, pantheon):
+        deities = parse_category_page(loader.get(WIKI_URL+'Category:'+pantheon, CATEGORY_READY), WIKI_URL)
+
+        if verbose:
+            for deity in deities:
+                print('{} from {} successfully added'.format(deity, pantheon))
+
+        return deities
+
+    own_loader = loader is None
+    loader = loader or make_loader(mode)
+
+    try:
+        return scrape_pantheons(list(in_list), scrape, loader, max_workers)
+
+    finally:
+        if own_loader:
+            loader.close()
+
+
+def get_deity_details(in_dict:dict, verbose=False, mode='browser', max_workers=MAX_WORKERS, loader=None):
 
-def get_deity_details(in_dict:dict, verbose=False, sleep_time=5): 
-    
     """
     Collects data from the Forgotten Realms Fandom Wiki.
 
-    Args: dictionary of deity - url pairs as generated with the get_deity_url function.
-     
+    Args: dictionary of deity - url pairs as generated with the get_deity_url function,
+    and optionally the scraping mode, the number of pantheons scraped in parallel and a page loader to reuse
+    (eg. the one used by get_deity_url, so that browsers are not started again).
+
     Returns:  a nested dictionary summarizing, for each deity, their alignment and domains.
     """
 
-    out_dict = {}
-    
-    #Define url and driver
-    page_url, driver = load_wiki_main_page()
+    def scrape(loader, pantheon):
+        out_dict = {}
 
-    # Loop over deities to retrieve associated attributes:
-    
-    pantheons = list(in_dict.keys())
-    
-    for pantheon in pantheons:
-        
-        out_dict[pantheon] = {}
-        
         for deity, deity_url in in_dict[pantheon].items():
-            
+
             if verbose:
-                print('Processing: {}'.format(deity))                   
-    
-            # Go to the deity page
-            driver.get(deity_url)
-            time.sleep(sleep_time)
-        
+                print('Processing: {}'.format(deity))
+
             # Skip deities that are not referred to in 5E
-            try:
-                driver.find_element(By.XPATH,'//*[contains(@data-item-name, "edition5")]')
-                                                           
-            except NoSuchElementException:
+            details = parse_deity_page(loader.get(deity_url, DEITY_READY))
+
+            if details is None:
                 if verbose:
                     print("{} has no 5E tab".format(deity))
                 continue
-             
-    
-            try:
-                # Extract attributes
-                deity_alignment = driver.find_element(By.XPATH, 
-                                                        '//*[contains(@data-source,"alignment5e")]/div'
-                                                        ).text 
-        
-            except NoSuchElementException:
-                deity_alignment = ''
-                pass
-    
-            try:
-    
-                deity_domains = driver.find_element(By.XPATH,
-                                                    '//*[contains(@data-source, "domains5e")]/div'
-                                                    ).text.split(',\n')
-        
-            except NoSuchElementException:
-                deity_domains = ''
-                pass
-                
-        
-            # Append attributes to the dictionary
-            out_dict[pantheon].update({
-                deity : {
-                    'deity_alignment': deity_alignment,
-                    'deity_domains' : deity_domains,
-                }
-            })
-                            
-    return out_dict
 
+            out_dict[deity] = details
+
+        return out_dict
+
+    own_loader = loader is None
+    loader = loader or make_loader(mode)
+
+    try:
+        return scrape_pantheons(list(in_dict), scrape, loader, max_workers)
 
+    finally:
+        if own_loader:
+            loader.close()
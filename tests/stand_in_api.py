@@ -0,0 +1,126 @@
+"""
+Stand-in for the D&D 5E API (dnd5eapi.co): serves canned race documents after a simulated latency,
+and answers some requests with a 503 error, to test concurrent fetching, retries and backoff without network access.
+Documents have ETag and Last-Modified headers, and conditional requests are answered with 304 Not Modified
+until the documents are changed (by increasing the server revision), to test the response cache.
+
+Run on its own: python -m tests.stand_in_api [--port 8001] [--latency 0.2] [--fail-every 7]
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RACES = ['dragonborn', 'dwarf', 'elf', 'gnome', 'half-elf', 'half-orc', 'halfling', 'human', 'tiefling']
+
+
+def race_document(index):
+    return {
+        'index': index,
+        'name': index.title(),
+        'speed': 25 if index in ('dwarf', 'gnome', 'halfling') else 30,
+        'languages': [{'name': 'Common'}],
+        'traits': [{'name': 'Trait of ' + index}],
+        'starting_proficiencies': [],
+        'ability_bonuses': [{'ability_score': {'name': 'CON'}, 'bonus': 2}],
+        'subraces': [],
+    }
+
+
+class StandInAPI(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering like the API after latency seconds (latency may be a function of the path),
+    failing one request out of fail_every with a 503 error (0 never fails). Requests are counted by status,
+    and the conditional headers of each request (If-None-Match, If-Modified-Since) are recorded.
+
+    Documents change whenever revision is increased.
+    """
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.2, fail_every=0):
+        super().__init__(address, StandInHandler)
+        self.latency = latency
+        self.fail_every = fail_every
+        self.requests = 0
+        self.statuses = []
+        self.conditions = []
+        self.revision = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        latency = server.latency(self.path) if callable(server.latency) else server.latency
+        time.sleep(latency)
+
+        with server.lock:
+            server.requests += 1
+            failed = server.fail_every and server.requests % server.fail_every == 0
+
+        conditions = {name: self.headers[name] for name in ('If-None-Match', 'If-Modified-Since') if name in self.headers}
+        revision = server.revision
+
+        if failed:
+            status, body = 503, {'error': 'Service Unavailable'}
+        elif self.path == '/api/races':
+            status, body = 200, {'count': len(RACES), 'results': [{'index': race, 'name': race.title(), 'url': '/api/races/' + race} for race in RACES]}
+        elif self.path.startswith('/api/races/') and self.path.split('/')[-1] in RACES:
+            status, body = 200, dict(race_document(self.path.split('/')[-1]), revision=revision)
+        else:
+            status, body = 404, {'error': 'Not found'}
+
+        data = json.dumps(body).encode()
+        headers = {}
+
+        if status == 200:
+            headers['ETag'] = '"{}"'.format(hashlib.sha1(data).hexdigest())
+            headers['Last-Modified'] = 'Mon, {:02d} Jan 2024 00:00:00 GMT'.format(1 + revision % 28)
+
+            # The ETag takes precedence over the modification date
+            if 'If-None-Match' in conditions:
+                not_modified = conditions['If-None-Match'] == headers['ETag']
+            else:
+                not_modified = conditions.get('If-Modified-Since') == headers['Last-Modified']
+
+            if not_modified:
+                status, data = 304, b''
+
+        with server.lock:
+            server.statuses.append(status)
+            server.conditions.append(conditions)
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stand-in D&D 5E API server.')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds before each response')
+    parser.add_argument('--fail-every', type=int, default=7, help='answer one request out of N with a 503 (0: never)')
+    args = parser.parse_args(argv)
+
+    server = StandInAPI(('127.0.0.1', args.port), args.latency, args.fail_every)
+    print('Stand-in API on {}'.format(server.url))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
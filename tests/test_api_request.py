@@ -0,0 +1,158 @@
+import threading
+import time
+
+import pytest
+
+from lib import api_request
+from tests.stand_in_api import RACES, StandInAPI, race_document
+
+
+@pytest.fixture
+def api():
+    servers = []
+
+    def start(latency=0.05, fail_every=0):
+        server = StandInAPI(latency=latency, fail_every=fail_every)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    api_request.disable_cache()
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def race_urls():
+    return {race.title(): '/api/races/' + race for race in RACES}
+
+
+def test_results_keep_input_order(api):
+    # The first races answer last, so responses complete in reverse order
+    server = api(latency=lambda path: 0.02 * (len(RACES) - RACES.index(path.split('/')[-1])) if path.split('/')[-1] in RACES else 0)
+    session = api_request.make_session(len(RACES))
+
+    races = api_request.get_race_data(race_urls(), api_url=server.url, session=session, max_workers=len(RACES))
+
+    assert list(races) == list(race_urls())
+    assert [race['racial_traits'] for race in races.values()] == [['Trait of ' + race] for race in RACES]
+
+
+def test_requests_run_concurrently(api):
+    server = api(latency=0.2)
+    session = api_request.make_session(len(RACES))
+
+    start = time.perf_counter()
+    api_request.get_race_data(race_urls(), api_url=server.url, session=session, max_workers=len(RACES))
+
+    # Sequential requests would take 9 x 0.2 s
+    assert time.perf_counter() - start < 0.2 * len(RACES) / 2
+
+
+def test_recovers_from_503_errors(api):
+    server = api(latency=0.01, fail_every=3)
+    session = api_request.make_session(4, backoff_factor=0.01)
+
+    races = api_request.get_race_data(race_urls(), api_url=server.url, session=session, max_workers=4)
+
+    assert list(races) == list(race_urls())
+    assert server.statuses.count(503) >= 3
+    assert server.statuses.count(200) == len(RACES)
+
+
+def test_gives_up_after_retries(api):
+    server = api(latency=0, fail_every=1)
+    session = api_request.make_session(1, retries=2, backoff_factor=0)
+
+    with pytest.raises(api_request.requests.RequestException):
+        api_request.fetch_json(server.url + '/api/races/elf', session)
+
+    # The first attempt and two retries
+    assert server.statuses == [503, 503, 503]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = api_request.enable_cache(str(tmp_path))
+    yield cache
+    api_request.disable_cache()
+
+
+def test_cache_miss_then_hit(api, cache):
+    server = api(latency=0)
+    session = api_request.make_session(1)
+    url = server.url + '/api/races/elf'
+
+    first = api_request.fetch_json(url, session)
+    second = api_request.fetch_json(url, session)
+
+    assert first == second == dict(race_document('elf'), revision=0)
+    assert server.statuses == [200, 304]
+    assert cache.stats == {'misses': 1, 'hits': 1}
+
+    # The cached document is revalidated with its ETag and modification date
+    entry = cache.get(url)
+    assert server.conditions[1] == {'If-None-Match': entry['etag'], 'If-Modified-Since': entry['last_modified']}
+
+
+def test_cache_downloads_changed_documents(api, cache):
+    server = api(latency=0)
+    session = api_request.make_session(1)
+    url = server.url + '/api/races/elf'
+
+    api_request.fetch_json(url, session)
+    server.revision = 1
+
+    assert api_request.fetch_json(url, session)['revision'] == 1
+    assert api_request.fetch_json(url, session)['revision'] == 1
+    assert server.statuses == [200, 200, 304]
+    assert cache.stats == {'misses': 2, 'hits': 1}
+
+
+def test_cache_serves_documents_when_the_server_fails(api, cache):
+    server = api(latency=0)
+    session = api_request.make_session(1, retries=1, backoff_factor=0)
+    url = server.url + '/api/races/elf'
+    document = api_request.fetch_json(url, session)
+
+    # 5xx errors, once retries are exhausted
+    server.fail_every = 1
+    assert api_request.fetch_json(url, session) == document
+
+    # Timeouts
+    server.fail_every, server.latency = 0, 0.5
+    assert api_request.fetch_json(url, session, timeout=0.1) == document
+
+    assert cache.stats == {'misses': 1, 'offline': 2}
+
+
+def test_offline_cache_never_sends_requests(api, cache):
+    server = api(latency=0)
+    session = api_request.make_session(1)
+    url = server.url + '/api/races/elf'
+    document = api_request.fetch_json(url, session)
+
+    cache.offline = True
+    assert api_request.fetch_json(url, session) == document
+
+    with pytest.raises(api_request.NotCached):
+        api_request.fetch_json(server.url + '/api/races/dwarf', session)
+
+    assert server.statuses == [200]
+    assert cache.stats == {'misses': 1, 'offline': 1}
+
+
+def test_listings_are_only_shared_explicitly(api, cache):
+    server = api(latency=0)
+    listings = {}
+
+    assert api_request.get_url('races', server.url, listings) == race_urls()
+    assert api_request.get_elements('races', server.url, listings) == list(race_urls())
+    assert server.statuses == [200]
+
+    # Without shared listings, the listing is revalidated on every call
+    api_request.get_elements('races', server.url)
+    api_request.get_elements('races', server.url)
+    assert server.statuses == [200, 304, 304]
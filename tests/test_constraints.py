@@ -0,0 +1,48 @@
+import pytest
+
+from lib.constraints import Constraints
+from lib.probability import ProbabilityEngine
+
+
+def test_characters_satisfy_the_conditions():
+    constraints = Constraints(
+        'roll', race='Dwarf', classname=['Cleric', 'Paladin'], alignment='Lawful Good',
+        scores={'WIS': 14, 'STR': (None, 12), 'CON': (10, 15)},
+        )
+
+    for character in constraints.generate_many(500, seed=1):
+        assert character.race == 'Dwarf'
+        assert character.classname in ('Cleric', 'Paladin')
+        assert character.alignment == 'Lawful Good'
+        assert character.ability_scores['WIS'] >= 14
+        assert character.ability_scores['STR'] <= 12
+        assert 10 <= character.ability_scores['CON'] <= 15
+
+
+def test_standard_array_and_deities():
+    deities = ['Corellon', 'Sehanine Moonbow']
+    constraints = Constraints('standard', deity=deities, scores={'DEX': 16})
+
+    for character in constraints.generate_many(500, seed=2):
+        assert character.deity in deities
+        assert character.ability_scores['DEX'] >= 16
+
+
+def test_same_id_gives_the_same_character():
+    constraints = Constraints('roll', race='Half-Orc', classname='Fighter', scores={'STR': 16})
+    character = constraints.generate(42)
+
+    assert character.character_id is None
+    assert constraints.generate(character.constrained_id).attribute_dict == character.attribute_dict
+    assert [str(c) for c in constraints.generate_many(20, seed=3)] == [str(c) for c in constraints.generate_many(20, seed=3)]
+
+
+def test_acceptance_rate_is_the_exact_probability():
+    conditions = {'race': 'Half-Orc', 'classname': 'Fighter', 'scores': {'STR': 16}}
+
+    assert Constraints('roll', **conditions).acceptance_rate() == ProbabilityEngine(method='roll').probability(**conditions)
+
+
+def test_impossible_conditions():
+    with pytest.raises(ValueError):
+        Constraints('standard', race='Dwarf', subrace='Hill Dwarf', scores={'WIS': 17})
@@ -0,0 +1,60 @@
+import itertools
+import math
+from collections import Counter
+from fractions import Fraction
+
+import pytest
+
+from lib.character_generator import generate_character, make_character_id
+from lib.probability import ProbabilityEngine, roll_distribution
+
+
+@pytest.fixture(scope='module')
+def engine():
+    return ProbabilityEngine(method='roll')
+
+
+def within(count, n, probability, sigmas=5):
+    # Whether count successes out of n trials agree with the probability (normal approximation)
+    return abs(count - n * probability) <= sigmas * math.sqrt(n * probability * (1 - probability))
+
+
+def test_roll_distribution_is_4d6_drop_lowest():
+    counts = Counter(sum(sorted(dice)[1:]) for dice in itertools.product(range(1, 7), repeat=4))
+
+    assert roll_distribution() == {score: Fraction(count, 6**4) for score, count in counts.items()}
+
+
+def test_readme_probability(engine):
+    assert engine.probability(race='Half-Orc', classname='Fighter', scores={'STR': 16}) == Fraction(115, 34992)
+
+
+def test_distributions_sum_to_one(engine):
+    assert sum(engine.distribution('race').values()) == 1
+    assert sum(engine.distribution('deity', race='Half-Elf').values()) == 1
+    assert sum(engine.distribution('STR', race='Dwarf', classname='Cleric').values()) == 1
+
+
+def test_conditional_probability(engine):
+    event, given = {'scores': {'STR': 16}}, {'race': 'Half-Orc', 'classname': 'Fighter'}
+
+    assert engine.conditional(event, given) == engine.probability(**given, **event) / engine.probability(**given)
+
+
+def test_impossible_conditions(engine):
+    assert engine.probability(race='Dwarf', subrace='High Elf') == 0
+
+    with pytest.raises(ZeroDivisionError):
+        engine.distribution('class', race='Dwarf', subrace='High Elf')
+
+
+def test_agrees_with_generated_characters(engine):
+    n = 20000
+    characters = [generate_character('roll', make_character_id(3, index)) for index in range(n)]
+
+    strong_fighters = sum(character.classname == 'Fighter' and character.ability_scores['STR'] >= 16 for character in characters)
+    assert within(strong_fighters, n, float(engine.probability(classname='Fighter', scores={'STR': 16})))
+
+    elves = [character for character in characters if character.race == 'Elf']
+    for deity, probability in engine.distribution('deity', race='Elf').items():
+        assert within(sum(character.deity == deity for character in elves), len(elves), float(probability))
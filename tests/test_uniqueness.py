@@ -0,0 +1,50 @@
+import pytest
+
+from lib.character_generator import generate_character, make_character_id
+from lib.constraints import Constraints
+from lib.uniqueness import BloomFilter, SpaceExhausted, combination_space, fingerprint, generate_unique_roster
+
+
+def hill_dwarf_clerics(**scores):
+    return Constraints('standard', race='Dwarf', subrace='Hill Dwarf', classname='Cleric', subclass='Life', scores=scores)
+
+
+def test_combination_space_of_constraints():
+    # Standard array with 15 in WIS and 8 in STR: the 4 other scores in any order, and a single deity
+    assert combination_space(constraints=hill_dwarf_clerics(WIS=16, STR=(None, 9))) == 24
+
+
+def test_roster_has_no_duplicate_build():
+    constraints = hill_dwarf_clerics(WIS=16, STR=(None, 9))
+    characters = list(generate_unique_roster(24, 'standard', 1, constraints=constraints))
+
+    assert len({fingerprint(character, constraints.dataset) for character in characters}) == 24
+
+
+def test_too_many_characters_requested():
+    with pytest.raises(ValueError):
+        next(generate_unique_roster(25, 'standard', 1, constraints=hill_dwarf_clerics(WIS=16, STR=(None, 9))))
+
+
+def test_space_exhausted_after_duplicates_in_a_row():
+    constraints = hill_dwarf_clerics(WIS=16, STR=(None, 9))
+
+    with pytest.raises(SpaceExhausted):
+        list(generate_unique_roster(24, 'standard', 1, constraints=constraints, max_rejections=1))
+
+
+def test_roster_characters_are_generated_again_from_their_id():
+    characters = list(generate_unique_roster(50, 'roll', 7, mode='bloom'))
+
+    for character in characters[:10]:
+        assert generate_character('roll', character.character_id).attribute_dict == character.attribute_dict
+    assert characters[0].character_id == make_character_id(7, 0)
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000)
+
+    assert all(bloom.add(key) for key in range(0, 3000, 3))
+    assert all(key in bloom for key in range(0, 3000, 3))
+    assert not bloom.add(0)
+    assert len(bloom) == 1000
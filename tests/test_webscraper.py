@@ -0,0 +1,88 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from lib.webscraper import WIKI_URL, StaticLoader, get_deity_details, parse_category_page, parse_deity_page
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'wiki')
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as html_file:
+        return html_file.read()
+
+
+def test_parse_category_page():
+    deities = parse_category_page(read_fixture('Category_Seldarine.html'))
+
+    # Subcategories (other pantheons) and other links are skipped, names are stripped
+    assert deities == {
+        'Corellon': WIKI_URL + 'Corellon',
+        'Sehanine Moonbow': WIKI_URL + 'Sehanine_Moonbow',
+        'Solonor Thelandira': WIKI_URL + 'Solonor_Thelandira',
+    }
+
+
+def test_parse_deity_page():
+    # Citation markers are part of the text, as in dataset.json
+    assert parse_deity_page(read_fixture('Corellon.html')) == {
+        'deity_alignment': 'Chaotic good[1]',
+        'deity_domains': ['Arcana, Life, Light, War'],
+    }
+
+    # Domains separated by line breaks are split, as in dataset.json
+    assert parse_deity_page(read_fixture('Solonor_Thelandira.html')) == {
+        'deity_alignment': 'Chaotic good',
+        'deity_domains': ['Nature', 'War'],
+    }
+
+
+def test_parse_deity_page_without_5e_tab():
+    assert parse_deity_page(read_fixture('Sehanine_Moonbow.html')) is None
+
+
+def test_get_deity_details_from_saved_pages():
+    urls = {'Seldarine': {
+        name: os.path.join(FIXTURES, name.replace(' ', '_') + '.html')
+        for name in ['Corellon', 'Sehanine Moonbow', 'Solonor Thelandira']
+    }}
+
+    details = get_deity_details(urls, mode='static', max_workers=2)
+
+    assert list(details['Seldarine']) == ['Corellon', 'Solonor Thelandira']
+    assert details['Seldarine']['Solonor Thelandira']['deity_domains'] == ['Nature', 'War']
+
+
+@pytest.fixture
+def wiki_server():
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = '<p>Tarsellis Meunniduin – Sehanine’s herald</p>'.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html') # No charset, as some wiki pages
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield 'http://127.0.0.1:{}/'.format(server.server_port)
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_static_loader_decodes_pages_without_charset_as_utf8(wiki_server):
+    loader = StaticLoader()
+
+    try:
+        assert loader.get(wiki_server + 'wiki/Tarsellis_Meunniduin') == '<p>Tarsellis Meunniduin – Sehanine’s herald</p>'
+    finally:
+        loader.close()